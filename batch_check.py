@@ -0,0 +1,217 @@
+'''
+Checks many documents without the GUI, writing one JSON line per document (as soon as it's done) to stdout or --out.\n
+Documents are .txt files (or every .txt file in a directory), or lines of stdin (plain text, or JSON objects with "id" and "text"):\n
+    $ python batch_check.py essays/ --workers 8 --explain --out results.jsonl\n
+    $ cat documents.jsonl | python batch_check.py --out results.jsonl --resume\n
+With --resume, documents already checked without errors in --out are skipped, so a crashed run can be picked up where it stopped.
+A throughput / latency summary is printed to stderr at the end.
+'''
+
+import asyncio
+import argparse
+import base64
+import json
+import os
+import sys
+import time
+from typing import List, Optional, AsyncIterator, Tuple
+import openai
+import gpt_tester
+import tracing
+
+# Documents checked at the same time
+DEFAULT_WORKERS = 4
+# Documents read ahead of the workers (per worker)
+READ_AHEAD = 2
+
+def find_files(paths: List[str]) -> List[str]:
+    # Every path given, with directories replaced by the .txt files in them
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += [os.path.join(path, name) for name in sorted(os.listdir(path)) if name.endswith('.txt')]
+        else:
+            files.append(path)
+    return files
+
+def parse_line(line: str, line_num: int) -> Tuple[str, str]:
+    '''
+    Reads one line of stdin.\n
+    Takes in line, line_num; returns (doc_id, text). JSON objects keep their "id" (or get 'stdin:<line_num>'); anything else is the text itself.
+    '''
+    line = line.rstrip('\n')
+    try:
+        document = json.loads(line)
+    except json.JSONDecodeError:
+        document = None
+    if isinstance(document, dict) and isinstance(document.get('text'), str):
+        return (str(document.get('id', f'stdin:{line_num}')), document['text'])
+    return (f'stdin:{line_num}', line)
+
+async def read_documents(paths: List[str]) -> AsyncIterator[Tuple[str, str]]:
+    '''
+    Streams documents from paths[] (files are read one at a time), or from stdin if there are none.\n
+    Takes in paths[]; yields (doc_id, text).
+    '''
+    loop = asyncio.get_running_loop()
+    if paths:
+        for path in find_files(paths):
+            with open(path, 'r') as file:
+                yield (path, await loop.run_in_executor(None, file.read))
+        return
+    line_num = 0
+    while True:
+        # Read stdin without blocking the workers
+        line = await loop.run_in_executor(None, sys.stdin.readline)
+        if line == '':
+            return
+        line_num += 1
+        if line.strip() != '':
+            yield parse_line(line, line_num)
+
+def load_checkpoint(out_path: str) -> set:
+    '''
+    Finds the documents already checked in out_path (lines cut off by a crash and failed documents don't count).\n
+    Takes in out_path; returns the set of doc ids to skip.
+    '''
+    done = set()
+    if not os.path.isfile(out_path):
+        return done
+    with open(out_path, 'r') as file:
+        for line in file:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(result, dict) and result.get('err_instr') == '':
+                done.add(result['id'])
+    return done
+
+def open_output(out_path: Optional[str], resume: bool):
+    # stdout, or out_path (appended to if resuming, after finishing any line a crash cut off)
+    if out_path == None:
+        return sys.stdout
+    if resume and os.path.isfile(out_path) and os.path.getsize(out_path) > 0:
+        with open(out_path, 'rb') as file:
+            file.seek(-1, os.SEEK_END)
+            complete = file.read(1) == b'\n'
+        out = open(out_path, 'a')
+        if not complete:
+            out.write('\n')
+        return out
+    return open(out_path, 'w')
+
+async def check_document(doc_id: str, text: str, explain: bool) -> dict:
+    '''
+    Checks one document (and explains each error if explain).\n
+    Takes in doc_id, text, explain; returns its result (id, errors[], err_instr, latency, usage counters).
+    '''
+    counters = gpt_tester.track_usage()
+    start = time.perf_counter()
+    (results, err_instr) = await gpt_tester.recheck(text, [])
+    errors = [{'sentence': result.sentence, 'corrected': result.corrected, 'start': result.start, 'end': result.end, 'source': result.source} for result in results if result != None and result.has_error]
+    # If a sentence failed, the document is incomplete (and gets checked again on --resume)
+    if err_instr == '' and None in results:
+        err_instr = 'Some sentences could not be checked.'
+    if explain:
+        explanations = await asyncio.gather(*[gpt_tester.explain_error(error['sentence'], error['corrected']) for error in errors])
+        for (error, (explanation, explain_err_instr)) in zip(errors, explanations):
+            error['explanation'] = explanation
+            if explain_err_instr != '':
+                err_instr = err_instr or explain_err_instr
+    return {'id': doc_id, 'errors': errors, 'err_instr': err_instr, 'latency': time.perf_counter() - start, 'usage': dict(counters)}
+
+async def run(args: argparse.Namespace) -> dict:
+    '''
+    Checks every document with args.workers workers, writing each result as soon as it's done.\n
+    Takes in args; returns the run's summary.
+    '''
+    skip = load_checkpoint(args.out) if args.resume and args.out != None else set()
+    out = open_output(args.out, args.resume)
+    queue = asyncio.Queue(maxsize=args.workers * READ_AHEAD)
+    runs = []
+    skipped = 0
+
+    async def worker():
+        while True:
+            document = await queue.get()
+            if document == None:
+                return
+            (doc_id, text) = document
+            try:
+                result = await gpt_tester.in_action('Check document', check_document(doc_id, text, args.explain))
+            except Exception as e:
+                result = {'id': doc_id, 'errors': [], 'err_instr': f'{type(e).__name__}: {e}', 'latency': 0.0, 'usage': {}}
+            # Write (and flush) each line whole, so a crash never leaves a result half-written
+            out.write(json.dumps(result) + '\n')
+            out.flush()
+            run = dict(result['usage'])
+            run['latency'] = result['latency']
+            run['err_instr'] = result['err_instr']
+            runs.append(run)
+
+    gpt_tester.client = gpt_tester.OpenAIClient(request_timeout=args.request_timeout)
+    await gpt_tester.client.start()
+    start = time.perf_counter()
+    workers = [asyncio.create_task(worker()) for i in range(0, args.workers)]
+    try:
+        async for (doc_id, text) in read_documents(args.inputs):
+            if doc_id in skip:
+                skipped += 1
+                continue
+            await queue.put((doc_id, text))
+        for task in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+    finally:
+        for task in workers:
+            task.cancel()
+        await gpt_tester.client.close()
+        if out is not sys.stdout:
+            out.close()
+
+    # Same summary as benchmark.py (failed documents included, and missing counters counted as 0)
+    counter_names = ['calls', 'cached', 'deduped', 'failed', 'prompt_tokens', 'completion_tokens', 'screened']
+    summary = tracing.summarize([dict({name: 0 for name in counter_names}, **run) for run in runs], time.perf_counter() - start)
+    summary['skipped'] = skipped
+    return summary
+
+def load_api_key() -> Optional[str]:
+    # OPENAI_API_KEY, or the key saved by display.py in 'credentials.json'
+    if os.environ.get('OPENAI_API_KEY'):
+        return os.environ['OPENAI_API_KEY']
+    try:
+        with open('credentials.json', 'r') as credentials:
+            return base64.b64decode(json.load(credentials)['OPENAI_API_KEY'].encode()).decode()
+    except (OSError, ValueError, KeyError):
+        return None
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Check many documents for grammatical errors, writing one JSON line per document.')
+    parser.add_argument('inputs', nargs='*', metavar='PATH', help='.txt files or directories of them (default: read documents from stdin, one per line)')
+    parser.add_argument('--out', default=None, help='JSONL file to write results to (default: stdout)')
+    parser.add_argument('--resume', action='store_true', help='skip documents already checked in --out, and append to it')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='documents checked at the same time')
+    parser.add_argument('--explain', action='store_true', help='also explain each error')
+    parser.add_argument('--no-cache', action='store_true', help="don't use (or fill) the response cache")
+    parser.add_argument('--no-prescreen', action='store_true', help='send every sentence to the model')
+    parser.add_argument('--prescreen-score', action='store_true', help='also pass sentences made only of word pairs seen in confirmed-correct sentences (can pass some errors)')
+    parser.add_argument('--request-timeout', type=float, default=gpt_tester.REQUEST_TIMEOUT)
+    parser.add_argument('--trace', default=None, metavar='PATH', help='save a Chrome trace of every call (open in chrome://tracing or ui.perfetto.dev)')
+    return parser.parse_args(argv)
+
+if __name__ == '__main__':
+    args = parse_args()
+    openai.api_key = load_api_key()
+    if openai.api_key == None:
+        sys.exit('No API key: set OPENAI_API_KEY, or run display.py once to save one.')
+    if args.no_cache:
+        gpt_tester.cache = None
+    if args.no_prescreen:
+        gpt_tester.screener = None
+    elif args.prescreen_score:
+        gpt_tester.screener.use_score = True
+    summary = asyncio.run(run(args))
+    print(json.dumps(summary, indent=2), file=sys.stderr)
+    if args.trace:
+        gpt_tester.tracer.export(args.trace)
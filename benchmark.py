@@ -0,0 +1,175 @@
+'''
+Benchmarks the check / explain / practice flows against the local mock server (see mock_server.py).\n
+Reports p50/p95/p99 latency, calls and tokens per document and wall-clock throughput, and saves the results as JSON so runs can be compared across commits:\n
+    $ python benchmark.py --sizes 1 10 100 500 --docs 5 --default-latency lognormal:0.4,0.5 --latency gpt-4=lognormal:1.5,0.5 --out results.json
+'''
+
+import asyncio
+import argparse
+import json
+import os
+import random
+import subprocess
+import time
+from typing import List
+import openai
+import gpt_tester
+import mock_server
+import response_cache
+import prescreen
+import hedging
+import tracing
+
+DEFAULT_SIZES = [1, 5, 20, 100, 500]
+DEFAULT_OUT = 'benchmark_results.json'
+
+SUBJECTS = ['The report', 'Our manager', 'The client', 'This proposal', 'The new intern', 'She', 'He', 'They', 'We', 'The team']
+CORRECT_TEMPLATES = ['{subject} reviewed the numbers for quarter {n}.', '{subject} will send the slides by {day}.', '{subject} met with {n} customers last week.', '{subject} needs approval before {day}.']
+INCORRECT_TEMPLATES = ['He are responsible for project {n}.', 'They was late to meeting {n}.', 'She have {n} reports to finish by {day}.', 'We is presenting on {day}.', 'The intern were at desk {n}.']
+DAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday']
+
+def make_document(n_sentences: int, error_rate: float, rand: random.Random) -> str:
+    '''
+    Makes a writing sample with n_sentences sentences, about error_rate of which contain a grammatical error.\n
+    Takes in n_sentences, error_rate, rand; returns the document.
+    '''
+    sentences = []
+    for i in range(0, n_sentences):
+        template = rand.choice(INCORRECT_TEMPLATES) if rand.random() < error_rate else rand.choice(CORRECT_TEMPLATES)
+        sentences.append(template.format(subject=rand.choice(SUBJECTS), n=rand.randint(1, 10000), day=rand.choice(DAYS)))
+    return ' '.join(sentences)
+
+def load_corpus(corpus_dir: str) -> List[str]:
+    # Every .txt file in corpus_dir is one document
+    documents = []
+    for name in sorted(os.listdir(corpus_dir)):
+        if name.endswith('.txt'):
+            with open(os.path.join(corpus_dir, name), 'r') as file:
+                documents.append(file.read())
+    return documents
+
+async def timed(coro_fn, *args) -> dict:
+    '''
+    Runs one flow, counting its calls/tokens.\n
+    Takes in coro_fn, args; returns a run dict (latency, err_instr, usage counters, result).
+    '''
+    counters = gpt_tester.track_usage()
+    start = time.perf_counter()
+    result = await gpt_tester.in_action(coro_fn.__name__, coro_fn(*args))
+    run = dict(counters)
+    run['latency'] = time.perf_counter() - start
+    run['err_instr'] = result[-1]
+    run['result'] = result
+    return run
+
+async def run_flow(coro_fn, args_list: List[tuple], concurrency: int) -> dict:
+    # Runs coro_fn over every args tuple, at most concurrency at a time
+    semaphore = asyncio.Semaphore(concurrency)
+    async def bounded(args):
+        async with semaphore:
+            return await timed(coro_fn, *args)
+    start = time.perf_counter()
+    runs = await asyncio.gather(*[bounded(args) for args in args_list])
+    return (runs, time.perf_counter() - start)
+
+async def benchmark(args: argparse.Namespace) -> dict:
+    rand = random.Random(args.seed)
+
+    # Build the corpus (documents grouped by size)
+    if args.corpus:
+        corpus = {'corpus': load_corpus(args.corpus)}
+    else:
+        corpus = {str(size): [make_document(size, args.error_rate, rand) for i in range(0, args.docs)] for size in args.sizes}
+
+    # Start the simulated backend and point gpt_tester at it
+    error_rates = {kind: float(rate) for (kind, rate) in mock_server.parse_pairs(args.error).items()}
+    config = mock_server.MockConfig(latency=mock_server.parse_pairs(args.latency), default_latency=args.default_latency, token_delay=args.token_delay, error_rates=error_rates, seed=args.seed)
+    runner = await mock_server.start_mock_server(config, port=args.port)
+    gpt_tester.backend = gpt_tester.OpenAIBackend(api_base=f'http://{mock_server.DEFAULT_HOST}:{args.port}/v1')
+    openai.api_key = 'benchmark'
+    gpt_tester.client = gpt_tester.OpenAIClient(request_timeout=args.request_timeout)
+    await gpt_tester.client.start()
+    # Fresh in-memory cache, so runs don't depend on what an earlier run cached
+    gpt_tester.cache = response_cache.ResponseCache(path=':memory:') if args.cache else None
+    # Same for the pre-screen (it learns from the run's own confirmed sentences)
+    gpt_tester.screener = prescreen.PreScreen(path=':memory:', use_score=args.prescreen_score) if args.prescreen or args.prescreen_score else None
+    gpt_tester.hedger = hedging.Hedger(gpt_tester.HEDGED_CALL_TYPES, percentile=args.hedge_percentile, max_rate=args.hedge_rate) if args.hedge else None
+
+    results = {'check': {}, 'explain': {}, 'gen_incorrect': {}, 'gen_correct': {}, 'gen_exercise_bundle': {}}
+    try:
+        # Check (per document size)
+        error_pairs = []
+        for (size, documents) in corpus.items():
+            (runs, wall_time) = await run_flow(gpt_tester.check, [(document,) for document in documents], args.concurrency)
+            results['check'][size] = tracing.summarize(runs, wall_time)
+            for run in runs:
+                (errors, corrected, err_instr) = run['result']
+                error_pairs += list(zip(errors, corrected))
+            print(f'check     {size:>7} sentences: p50 {results["check"][size]["p50"]:.3f}s  p95 {results["check"][size]["p95"]:.3f}s  {results["check"][size]["calls_per_doc"]:.1f} calls/doc')
+
+        # Explain / practice (on errors found while checking)
+        error_pairs = error_pairs[:args.flow_runs]
+        flows = [('explain', gpt_tester.explain_error, error_pairs), ('gen_incorrect', gpt_tester.gen_incorrect, [(error,) for (error, correction) in error_pairs]), ('gen_correct', gpt_tester.gen_correct, [(error,) for (error, correction) in error_pairs]), ('gen_exercise_bundle', gpt_tester.gen_exercise_bundle, [(error, True) for (error, correction) in error_pairs])]
+        for (name, coro_fn, args_list) in flows:
+            (runs, wall_time) = await run_flow(coro_fn, args_list, args.concurrency)
+            results[name]['all'] = tracing.summarize(runs, wall_time)
+            print(f'{name:<13}        {len(runs):>4} runs: p50 {results[name]["all"]["p50"]:.3f}s  p95 {results[name]["all"]["p95"]:.3f}s  {results[name]["all"]["calls_per_doc"]:.1f} calls/run')
+    finally:
+        await gpt_tester.client.close()
+        await runner.cleanup()
+
+    return {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': {key: value for (key, value) in vars(args).items() if key != 'out'},
+        'connections': gpt_tester.client.stats(),
+        'mock_server': {'requests': config.requests, 'injected_errors': config.errors},
+        'prescreen': gpt_tester.screener.stats() if gpt_tester.screener != None else None,
+        'single_flight': dict(gpt_tester.single_flight),
+        'routing': gpt_tester.router.stats() if gpt_tester.router != None else None,
+        'hedging': gpt_tester.hedger.stats() if gpt_tester.hedger != None else None,
+        'trace': gpt_tester.tracer.summary() if gpt_tester.tracer != None else None,
+        'results': results
+    }
+
+def git_commit() -> str:
+    # Commit being benchmarked ('' if not in a git repo)
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Benchmark the check / explain / practice flows against a simulated backend.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='document sizes (in sentences)')
+    parser.add_argument('--docs', type=int, default=3, help='documents per size')
+    parser.add_argument('--corpus', default=None, metavar='DIR', help='use the .txt files in DIR instead of generated documents')
+    parser.add_argument('--error-rate', type=float, default=0.3, help='fraction of generated sentences with an error')
+    parser.add_argument('--flow-runs', type=int, default=20, help='max runs of each explain/practice flow')
+    parser.add_argument('--concurrency', type=int, default=1, help='documents/runs in flight at once')
+    parser.add_argument('--latency', action='append', default=[], metavar='MODEL=DIST', help='simulated latency for a model (see mock_server.py)')
+    parser.add_argument('--default-latency', default='lognormal:0.3,0.5', metavar='DIST')
+    parser.add_argument('--token-delay', type=float, default=0.0)
+    parser.add_argument('--error', action='append', default=[], metavar='KIND=RATE', help='injected error rate (see mock_server.py)')
+    parser.add_argument('--request-timeout', type=float, default=gpt_tester.REQUEST_TIMEOUT)
+    parser.add_argument('--cache', action='store_true', help='use an in-memory response cache during the run')
+    parser.add_argument('--prescreen', action='store_true', help='pass sentences already confirmed correct locally (pre-screen learning from the run)')
+    parser.add_argument('--prescreen-score', action='store_true', help='with the pre-screen, also pass sentences made only of word pairs seen in confirmed-correct sentences')
+    parser.add_argument('--hedge', action='store_true', help='send a duplicate of interactive requests slower than usual')
+    parser.add_argument('--hedge-percentile', type=float, default=hedging.HEDGE_PERCENTILE, help='latency percentile after which a request is hedged')
+    parser.add_argument('--hedge-rate', type=float, default=hedging.MAX_HEDGE_RATE, help='max fraction of requests hedged')
+    parser.add_argument('--port', type=int, default=mock_server.DEFAULT_PORT + 1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default=DEFAULT_OUT, help='where to save the JSON results')
+    parser.add_argument('--trace', default=None, metavar='PATH', help='also save a Chrome trace of every call (open in chrome://tracing or ui.perfetto.dev)')
+    return parser.parse_args(argv)
+
+if __name__ == '__main__':
+    args = parse_args()
+    report = asyncio.run(benchmark(args))
+    with open(args.out, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f'Saved results to {args.out}')
+    if args.trace:
+        gpt_tester.tracer.export(args.trace)
+        print(f'Saved trace to {args.trace}')
@@ -1,18 +1,133 @@
+import time
+# When the app started (for --startup-time)
+STARTED = time.perf_counter()
 import PySimpleGUI as sg
 import gpt_tester
 import random
 import os
+import sys
 import json
 import base64
 import asyncio
-from typing import Tuple, List
-
-with open('resources/icon.ico', 'rb') as file:
-    icon = file.read()
-sg.set_global_icon(base64.b64encode(icon))
+import types
+from typing import Tuple, List, Optional
+# When the imports finished
+IMPORTED = time.perf_counter()
 
 default_font = sg.DEFAULT_FONT
 
+# Number of practice exercises generated in the background ahead of the current one
+PREFETCH_AHEAD = 3
+# Max explanations fetched ahead of time (in the background, right after a check) per session; 0 turns warming up off
+WARM_UP_LIMIT = 20
+# How long (in ms) window.read() waits for an event before letting background tasks run
+READ_TIMEOUT = 20
+# Seconds a saved API key is trusted for after it was last verified; after that it's verified again in the background on launch
+KEY_VERIFY_TTL = 24 * 60 * 60
+# Errors that mean OpenAI couldn't be reached (not that the key is bad)
+OPENAI_PROB_ERR_MSGS = ['Request timed out. Please try again in a bit.', 'There is a problem with OpenAI. Please try again in a bit.', 
+                        'Failed to connect to OpenAI. Please check your network settings or firewall rules and try again.', 'Request was invalid. Please try again with a different input.',
+                        'Request exceeded rate limit. Please wait a minute and try again.', 'There is a problem with OpenAI. Please try again in a bit.']
+# If launched with --startup-time, report how long it took to show the first window (and which slow modules were loaded by then), then exit
+MEASURE_STARTUP = '--startup-time' in sys.argv
+# Modules that are slow to import, and shouldn't be needed to show the first window
+HEAVY_MODULES = ['openai', 'aiohttp', 'nltk']
+
+# ~ Functions to start up quickly ~ #
+def set_icon() -> None:
+    # Use LexEd's icon for every window
+    with open('resources/icon.ico', 'rb') as file:
+        icon = file.read()
+    sg.set_global_icon(base64.b64encode(icon))
+
+def startup_done(window: sg.Window) -> None:
+    '''
+    Called once a window is up. If measuring startup (--startup-time), prints the time taken (in seconds, as JSON) and exits.
+    '''
+    if not MEASURE_STARTUP:
+        return
+    window.refresh()
+    first_window = time.perf_counter() - STARTED
+    # Lazily imported modules stay placeholders until they're used
+    loaded = [name for name in HEAVY_MODULES if type(sys.modules.get(name)) is types.ModuleType]
+    print(json.dumps({'imports': IMPORTED - STARTED, 'first_window': first_window, 'heavy_modules_loaded': loaded}))
+    window.close()
+    sys.exit(0)
+
+async def start_client() -> None:
+    '''
+    Opens the pooled connection to OpenAI for the rest of the session (once; it loads openai, so it's done after the first window is up).
+    '''
+    if gpt_tester.client == None:
+        gpt_tester.client = gpt_tester.OpenAIClient()
+        await gpt_tester.client.start()
+
+def load_credentials() -> Tuple[str, float]:
+    '''
+    Reads 'credentials.json'.\n
+    Returns (openai_api_key, last_verified); last_verified is 0 if the key was never verified (or was saved by an older version).
+    '''
+    with open('credentials.json', 'r') as credentials:
+        creds_dict = json.load(credentials)
+    openai_api_key = base64.b64decode(creds_dict['OPENAI_API_KEY'].encode()).decode()
+    return (openai_api_key, float(creds_dict.get('LAST_VERIFIED', 0)))
+
+def save_credentials(openai_api_key: str, last_verified: float) -> None:
+    # Stores the key (as base64 str) and when it was last verified in 'credentials.json'
+    with open('credentials.json', 'w') as credentials:
+        openai_api_key_b64 = base64.b64encode(openai_api_key.encode()).decode()
+        json.dump({"OPENAI_API_KEY": openai_api_key_b64, "LAST_VERIFIED": last_verified}, credentials)
+
+def verify_saved_key(window: sg.Window) -> Optional[asyncio.Task]:
+    '''
+    Verifies the key in 'credentials.json' in the background (posting '-KEY_VERIFIED-' to window) if it hasn't been verified within KEY_VERIFY_TTL.\n
+    Takes in window; returns the task, or None if the key was verified recently enough.
+    '''
+    try:
+        (openai_api_key, last_verified) = load_credentials()
+    except Exception:
+        return None
+    if time.time() - last_verified < KEY_VERIFY_TTL:
+        return None
+    return start_task(window, '-KEY_VERIFIED-', gpt_tester.in_action('Verify key', gpt_tester.verify_key(openai_api_key)))
+
+# ~ Function to read window events without blocking background tasks ~ #
+async def read_window(window: sg.Window) -> Tuple[str, dict]:
+    '''
+    Reads the next window event, then gives background tasks (e.g. prefetching) time to make progress.\n
+    Takes in window; returns (event, values). event is sg.TIMEOUT_KEY if nothing happened.
+    '''
+    event, values = window.read(timeout=READ_TIMEOUT)
+    await asyncio.sleep(READ_TIMEOUT / 1000)
+    return (event, values)
+
+# ~ Functions to run model calls in the background ~ #
+def start_task(window: sg.Window, event: str, coro) -> asyncio.Task:
+    '''
+    Runs coro in the background, posting its result back to window as event once it finishes (so the window stays responsive while waiting).\n
+    Takes in window, event, coro; returns the task (cancel it to abort the call).\n
+    values[event] is coro's result, or None if it raised an exception. Nothing is posted if the task is cancelled.
+    '''
+    async def run():
+        try:
+            result = await coro
+        except Exception:
+            result = None
+        window.write_event_value(event, result)
+    return asyncio.create_task(run())
+
+def task_result(result, failed: tuple) -> tuple:
+    # Result posted by start_task(); if the call raised, failed + (err_instr,)
+    if result == None:
+        return failed + ("An error has occurred. Please try again.",)
+    return result
+
+async def cancel_task(task: asyncio.Task) -> None:
+    # Cancels task (if it's still running) and waits for it to clean up (e.g. stop its loading bar)
+    if task != None:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
 # ~ Function to build intro window ~ #
 async def build_intro(change_api_key=False) -> bool:
     '''
@@ -22,47 +137,39 @@ async def build_intro(change_api_key=False) -> bool:
 
     is_valid_key = False 
     init_err_msg = ''
-    OPENAI_PROB_ERR_MSGS = ['Request timed out. Please try again in a bit.', 'There is a problem with OpenAI. Please try again in a bit.', 
-                            'Failed to connect to OpenAI. Please check your network settings or firewall rules and try again.', 'Request was invalid. Please try again with a different input.',
-                            'Request exceeded rate limit. Please wait a minute and try again.', 'There is a problem with OpenAI. Please try again in a bit.']
 
-    # If first time launching app and 'credentials.json' exists and API keys are valid, return True
+    # If first time launching app and 'credentials.json' exists, use the saved key straight away (it's verified in the background if it's due; see verify_saved_key())
     if os.path.isfile('credentials.json') and not change_api_key:
-        with open('credentials.json', 'r') as credentials:
-            try:
-                creds_dict = json.load(credentials)
-                openai_api_key = base64.b64decode(creds_dict['OPENAI_API_KEY'].encode()).decode()
-                verify_key_task = asyncio.create_task(gpt_tester.verify_key(openai_api_key))
-                try:
-                    (is_valid_key, err_instr) = await verify_key_task
-                except asyncio.CancelledError:
-                    err_instr = "An error has occurred. Please try again."
-                # If exception:
-                if err_instr != '':
-                    # Set error message and then show prompt API key window
-                    init_err_msg = err_instr
-                # If no exception:
-                else:
-                    if is_valid_key:
-                        return is_valid_key #True
-                        # And then build SmartTutor
-            # In case there's an error opening/parsing credentials.json
-            except Exception as e:
-                is_valid_key = False
-                init_err_msg = 'There was an error loading your OpenAI API key. Please enter it again.'
+        try:
+            (openai_api_key, last_verified) = load_credentials()
+            gpt_tester.use_key(openai_api_key)
+            return True
+            # And then build SmartTutor
+        # In case there's an error opening/parsing credentials.json
+        except Exception as e:
+            is_valid_key = False
+            init_err_msg = 'There was an error loading your OpenAI API key. Please enter it again.'
             
     # Layout
     intro_layout = [
-        [sg.Text('Please input your API Key below:'), sg.Push(), sg.Button('Use current API Key', visible=change_api_key or init_err_msg in OPENAI_PROB_ERR_MSGS)],
+        [sg.Text('Please input your API Key below:'), sg.Push(), sg.Button('Use current API Key', visible=change_api_key)],
         [sg.Text('OpenAI API Key:'), sg.Input('', password_char='*', enable_events=True, focus=True, key='-OPENAI_API_KEY-')],
         [sg.Button('Submit', disabled=True), sg.Push(), sg.Text(init_err_msg, size=(40, None), text_color='dark orange', key='-ERR_MSG-'), sg.Push(), sg.Exit()]
     ]
     
     window = sg.Window(title='LexEd', layout=intro_layout, font=default_font, resizable=False, finalize=True)
+    startup_done(window)
+    await start_client()
+
+    # Key verification in flight, if any, and the key it's verifying
+    verify_key_task = None
+    submitted_key = ''
+    # Key in use before it (what 'Use current API Key' goes back to if the new one isn't valid)
+    current_key = None
 
     # Main loop
     while True:
-        event, values = window.read()
+        event, values = await read_window(window)
         if event in (sg.WIN_CLOSED, 'Exit'):
             is_valid_key = False
             break
@@ -72,15 +179,26 @@ async def build_intro(change_api_key=False) -> bool:
             if window['-OPENAI_API_KEY-'].get() != '':
                 window['Submit'].update(disabled=False)
         
-        # 'Submit' button: Verify API keys
-        if event == 'Submit':
+        # 'Submit' button: Verify API keys in the background (see '-VERIFIED-')
+        if event == 'Submit' and verify_key_task == None:
+            # Make the key intangible and 'Submit' unclickable until the key is verified (so the key saved is the one verified)
+            submitted_key = window['-OPENAI_API_KEY-'].get()
+            current_key = gpt_tester.openai.api_key
+            window['-OPENAI_API_KEY-'].update(disabled=True)
+            window['Submit'].update(disabled=True)
+            window['Use current API Key'].update(disabled=True)
+            verify_key_task = start_task(window, '-VERIFIED-', gpt_tester.in_action('Verify key', gpt_tester.verify_key(submitted_key, window=window)))
 
-            # Verify key
-            verify_key_task = asyncio.create_task(gpt_tester.verify_key(window['-OPENAI_API_KEY-'].get(), window=window))
-            try:
-                (is_valid_key, err_instr) = await verify_key_task
-            except asyncio.CancelledError:
-                err_instr = "An error has occurred. Please try again."
+        # The key was verified
+        if event == '-VERIFIED-' and verify_key_task != None:
+            verify_key_task = None
+            window['-OPENAI_API_KEY-'].update(disabled=False)
+            window['Submit'].update(disabled=False)
+            window['Use current API Key'].update(disabled=False)
+            (is_valid_key, err_instr) = task_result(values[event], (False,))
+            # verify_key() switched to the submitted key; if it isn't valid, switch back
+            if not is_valid_key:
+                gpt_tester.use_key(current_key)
 
             # If error, display error then go to beginning of loop:
             if err_instr != '':
@@ -88,11 +206,9 @@ async def build_intro(change_api_key=False) -> bool:
                 continue
             window['-ERR_MSG-'].update('')
 
-            # If key is valid, store key in 'credentials.json' (as base64 str)
+            # If key is valid, store key in 'credentials.json' (as base64 str, verified just now)
             if is_valid_key:
-                with open('credentials.json', 'w') as credentials:
-                    openai_api_key_b64 = base64.b64encode(window['-OPENAI_API_KEY-'].get().encode()).decode()
-                    json.dump({"OPENAI_API_KEY": openai_api_key_b64}, credentials)
+                save_credentials(submitted_key, time.time())
                 break
                 # And then build SmartTutor
             # If key is invalid, display error and have user try again
@@ -102,7 +218,9 @@ async def build_intro(change_api_key=False) -> bool:
         if event == 'Use current API Key':
             is_valid_key = True
             break
-                
+
+    # Stop verifying if the window was closed mid-check
+    await cancel_task(verify_key_task)
     window.close()
     
     # If key is valid and this came here from settings, build_SmartTutor(). Once SmartTutor() is legitimately exited, return False and break the loop/nest.
@@ -113,6 +231,129 @@ async def build_intro(change_api_key=False) -> bool:
     else:
         return is_valid_key
 
+# ~ Function to show streamed tokens as they arrive ~ #
+def stream_into(window: sg.Window, key: str):
+    '''
+    Makes a callback that shows streamed tokens in window[key] as they arrive.\n
+    Takes in window, key; returns on_token(token).
+    '''
+    tokens = []
+    def on_token(token: str) -> None:
+        tokens.append(token)
+        window[key].update(''.join(tokens))
+        window.refresh()
+    return on_token
+
+def stream_corrections(window: sg.Window, key: str):
+    '''
+    Makes a callback that lists each correction in window[key] as soon as its sentence is checked (replaced by the full list once the check finishes).\n
+    Takes in window, key; returns on_result(result).
+    '''
+    window[key].update('')
+    def on_result(result: gpt_tester.SentenceResult) -> None:
+        if result.has_error:
+            window[key].update(f'Original: {result.sentence}\nCorrected: {result.corrected}\n\n', append=True)
+            window.refresh()
+    return on_result
+
+# ~ Function to explain errors ahead of time ~ #
+def warm_up_explanation(sent_A: str, sent_B: str, window: sg.Window, dispatched: set) -> asyncio.Task:
+    '''
+    Starts explaining the error in sent_A in the background lane, posting '-WARMED_UP-' to window (with (sent_A, sent_B) as its value) once it's done.\n
+    Takes in sent_A, sent_B, window, dispatched (gets (sent_A, sent_B) added once the call has left the background queue); returns the task (its result is (explanation, err_instr)).
+    '''
+    async def warm_up():
+        gpt_tester.listen_for_dispatch(lambda waited: dispatched.add((sent_A, sent_B)))
+        return await gpt_tester.explain_error(sent_A, sent_B)
+    task = asyncio.create_task(gpt_tester.in_lane(gpt_tester.BACKGROUND, gpt_tester.in_action('Warm up', warm_up())))
+    def on_done(task: asyncio.Task) -> None:
+        if not task.cancelled():
+            window.write_event_value('-WARMED_UP-', (sent_A, sent_B))
+    task.add_done_callback(on_done)
+    return task
+
+# ~ Functions to generate practice exercises ahead of time ~ #
+async def gen_exercise(exercise: Tuple[str, bool]) -> Tuple[gpt_tester.Exercise, str]:
+    '''
+    Generates an exercise (a correct sentence if exercise[1], otherwise one with the same error as exercise[0]), along with its correction and explanation.\n
+    Takes in exercise; returns (bundle, err_instr).
+    '''
+    return await gpt_tester.gen_exercise_bundle(exercise[0], not exercise[1])
+
+def fill_prefetch(errors: List[Tuple[str, bool]], prefetched: List[asyncio.Task], error_num: int, recurring_errors: List[Tuple[str, bool]], recurring_prefetched: List[asyncio.Task]) -> None:
+    '''
+    Makes sure the next PREFETCH_AHEAD exercises after error_num are being generated in the background, continuing into recurring_errors[] (the next cycle) if the current cycle runs out.\n
+    Takes in errors[], prefetched[], error_num, recurring_errors[], recurring_prefetched[]; returns nothing.\n
+    prefetched[] and recurring_prefetched[] hold the generating task (or None) for each exercise in errors[] and recurring_errors[].
+    '''
+    upcoming = [(errors, prefetched, i) for i in range(error_num+1, len(errors))]
+    upcoming += [(recurring_errors, recurring_prefetched, i) for i in range(0, len(recurring_errors))]
+    for (exercises, tasks, i) in upcoming[:PREFETCH_AHEAD]:
+        if tasks[i] == None:
+            tasks[i] = asyncio.create_task(gpt_tester.in_lane(gpt_tester.BACKGROUND, gpt_tester.in_action('Prefetch', gen_exercise(exercises[i]))))
+
+def shuffle_cycle(recurring_errors: List[Tuple[str, bool]], recurring_prefetched: List[asyncio.Task]) -> Tuple[List[Tuple[str, bool]], List[asyncio.Task]]:
+    '''
+    Shuffles the exercises for the next cycle, keeping each one with its prefetch task.\n
+    Takes in recurring_errors[], recurring_prefetched[]; returns (errors[], prefetched[]).
+    '''
+    cycle = list(zip(recurring_errors, recurring_prefetched))
+    random.shuffle(cycle)
+    return ([exercise for (exercise, task) in cycle], [task for (exercise, task) in cycle])
+
+async def await_prefetched(task: asyncio.Task, window: sg.Window) -> tuple:
+    '''
+    Waits for a call started ahead of time (a prefetched exercise or warmed-up explanation), showing the loading bar in window if it isn't ready yet.\n
+    Takes in task, window; returns the task's (result, err_instr).
+    '''
+    result = None
+    loading_task = None
+    if not task.done():
+        loading_task = asyncio.create_task(gpt_tester.loading_bar(window=window))
+    try:
+        (result, err_instr) = await task
+    except asyncio.CancelledError:
+        err_instr = "An error has occurred. Please try again."
+    finally:
+        if loading_task != None:
+            loading_task.cancel()
+            window['-ERR_MSG-'].update('')
+    return (result, err_instr)
+
+# ~ Function to grade a practice exercise ~ #
+async def answer_exercise(bundle: gpt_tester.Exercise, answer: Optional[str], window: sg.Window) -> Tuple[bool, str, str, str]:
+    '''
+    Grades the user's answer to an exercise against its generated correction, only asking the model if that can't tell. If the exercise has no correction, asks the model instead (streaming the correct sentence into '-ANSWER-' and the explanation into '-EXPLANATION-' if the user got it wrong).\n
+    Takes in bundle (the exercise), answer (the user's correction, or None if they said an incorrect sentence was correct), window; returns (is_correct, corr_sent, explanation, err_instr).
+    '''
+    # If the correction and explanation were generated with the exercise, grade locally (answers with the same words as the correction need no model calls)
+    if bundle.correction != '':
+        if answer == None:
+            return (False, bundle.correction, bundle.explanation, '')
+        is_correct = gpt_tester.grade_answer(answer, bundle)
+        err_instr = ''
+        # If it's neither the correction nor the original sentence, ask the model
+        if is_correct == None:
+            (is_correct, err_instr) = await gpt_tester.is_correct(answer, window=window)
+        return (is_correct, bundle.correction, bundle.explanation, err_instr)
+    sentence = bundle.sentence
+    # If the user corrected the sentence, check their correction
+    if answer != None:
+        (is_correct, err_instr) = await gpt_tester.is_correct(answer, window=window)
+        if err_instr != '' or is_correct:
+            return (is_correct, '', '', err_instr)
+    else:
+        answer = sentence
+    # Generate correct sentence (streamed into '-ANSWER-')
+    window['-ANSWER-'].update('', text_color='light green')
+    (corr_sent, err_instr) = await gpt_tester.correct(sentence, window=window, on_token=stream_into(window, '-ANSWER-'))
+    if err_instr != '':
+        return (False, '', '', err_instr)
+    window['-ANSWER-'].update(corr_sent, text_color='light green')
+    # Explain (streamed into '-EXPLANATION-')
+    (explanation, err_instr) = await gpt_tester.explain_error(answer, corr_sent, window=window, on_token=stream_into(window, '-EXPLANATION-'))
+    return (False, corr_sent, explanation, err_instr)
+
 # ~ Function to build Practice window ~ #
 async def build_practice(errors_in: List[str], base_window: sg.Window) -> None:
     '''
@@ -122,49 +363,26 @@ async def build_practice(errors_in: List[str], base_window: sg.Window) -> None:
     '''
 
     errors = []
-    example_sents = []
     recurring_errors = []
     cycling_again_flag = False
     end_of_curr_cycle_flag = False
 
     for error in errors_in:
         errors.append((error, False))
-        example_sents.append(error)
 
-    # Adds random grammatically correct sentences to the pool (either 1 + 1/3 of len(errors) or 10, whichever is smaller)
-    for i in range(0, len(errors) // 3 + 1):
-        errors.append(('', True))
+    # Adds random grammatically correct sentences to the pool (1 + 1/3 of len(errors)), each one based on a different error
+    for example_sent in random.sample(errors_in, len(errors) // 3 + 1):
+        errors.append((example_sent, True))
     random.shuffle(errors)
 
-    error_num = 0
-    init_err_msg = ''
-
-    # Generating a correct sentence
-    if errors[error_num][1]:
-        sent_idx = random.randint(0, len(example_sents)-1)
-        gen_correct_task = asyncio.create_task(gpt_tester.gen_correct(example_sents[sent_idx], base_window))
-        try:
-            (curr_exercise, err_instr) = await gen_correct_task
-        except asyncio.CancelledError:
-            err_instr = "An error has occurred. Please try again."
-        # If error, display error (then build screen as normal)
-        if err_instr != '':
-            init_err_msg = err_instr
-        # If no error, remove example sentence from example_sents[]
-        else:
-            del example_sents[sent_idx]
-    # Generating an incorrect sentence
-    else:
-        gen_incorrect_task = asyncio.create_task(gpt_tester.gen_incorrect(errors[error_num][0], base_window))
-        try:
-            (curr_exercise, err_instr) = await gen_incorrect_task
-        except asyncio.CancelledError:
-            err_instr = "An error has occurred. Please try again."
-        if err_instr != '':
-            init_err_msg = err_instr
+    # Tasks generating each exercise in the background (None if not started yet)
+    prefetched = [None] * len(errors)
+    recurring_prefetched = []
 
-    # Updates errors[] with sentence (to be accessed while explaining)
-    errors[error_num] = (curr_exercise, errors[error_num][1])
+    # The first exercise is loaded the same way as the next ones (see '-EXERCISE_READY-')
+    error_num = -1
+    # Current exercise (with its correction and explanation)
+    bundle = None
 
     p_correct = 0
     p_incorrect = 0
@@ -173,26 +391,61 @@ async def build_practice(errors_in: List[str], base_window: sg.Window) -> None:
     # Screen layout
     practice_layout = [
         [sg.Push(), sg.Text(f'Is this sentence grammatically correct?', key='-P_INFO-', font=(default_font[0], default_font[1]+1, 'bold')), sg.Push()],
-        [sg.Push(), sg.Text('A:'), sg.Text(curr_exercise, key='-CURR_EXER-'), sg.Push()],
+        [sg.Push(), sg.Text('A:'), sg.Text('', key='-CURR_EXER-'), sg.Push()],
         [sg.Push(), sg.Col([[sg.Text('B:', visible=False, key='B'), sg.Input('', size=30, visible=False, key='-IN-'), sg.Submit('Check', visible=False)]], pad=(0,0)), sg.Push()],
-        [sg.Push(), sg.Col([[sg.Button('Correct'), sg.Button('Incorrect')], [sg.VPush()]], pad=(0,0)), sg.Push()],
+        [sg.Push(), sg.Col([[sg.Button('Correct', disabled=True), sg.Button('Incorrect', disabled=True)], [sg.VPush()]], pad=(0,0)), sg.Push()],
         [sg.Push(), sg.Text('', justification='center', key='-RESULT-'), sg.Push()],
         [sg.Push(), sg.Text('', justification='center', key='-ANSWER-'), sg.Push()],
         [sg.VPush()],
         [sg.Multiline('', size=(55, 4), disabled=True, text_color='white', background_color='SlateGray', key='-EXPLANATION-')],
         [sg.VPush()],
         [sg.Push(), sg.Text(p_remaining, text_color='yellow', key='-P_REM-'), sg.Text(p_correct, text_color='light green', key='-P_CORR-'), sg.Text(p_incorrect, text_color='red', key='-P_INCORR-')],
-        [sg.Text(init_err_msg, size=(40, 2), justification='left', text_color='dark orange', key='-ERR_MSG-'), sg.Push(), sg.Button('Next', disabled=True), sg.Exit(visible=False)]
+        [sg.Text('', size=(40, 2), justification='left', text_color='dark orange', key='-ERR_MSG-'), sg.Push(), sg.Button('Cancel', disabled=True), sg.Button('Next', disabled=True), sg.Exit(visible=False)]
     ]
 
-    window = sg.Window(title='Practice', layout=practice_layout, font=default_font, modal=True, resizable=False)
+    window = sg.Window(title='Practice', layout=practice_layout, font=default_font, modal=True, resizable=False, finalize=True)
+
+    # Model call in flight (and the event it posts when it finishes), if any
+    active_task = None
+    active_event = ''
+
+    # Start generating the first few exercises, then load the first one
+    fill_prefetch(errors, prefetched, error_num, recurring_errors, recurring_prefetched)
+    active_task = start_task(window, '-EXERCISE_READY-', gpt_tester.in_action('Next', await_prefetched(prefetched[error_num+1], window)))
+    active_event = '-EXERCISE_READY-'
+    window['Cancel'].update(disabled=False)
 
     # Main loop
     while True:
-        event, values = window.read()
+        event, values = await read_window(window)
         if event in (sg.WIN_CLOSED, 'Exit'):
             break
 
+        # Keep the next few exercises generating while the user works on this one
+        fill_prefetch(errors, prefetched, error_num, recurring_errors, recurring_prefetched)
+
+        # 'Cancel' button: Abort the model call in flight (only clickable while there is one)
+        if event == 'Cancel' and active_task != None:
+            await cancel_task(active_task)
+            active_task = None
+            window['Cancel'].update(disabled=True)
+            window['-ERR_MSG-'].update('Cancelled.', text_color='dark orange')
+            # If loading an exercise, let the user try again with 'Next' (generating it again if it was aborted)
+            if active_event == '-EXERCISE_READY-':
+                if prefetched[error_num+1] != None and prefetched[error_num+1].cancelled():
+                    prefetched[error_num+1] = None
+                window['Next'].update(disabled=False)
+            # If grading an answer, let the user answer again
+            else:
+                window['-RESULT-'].update('')
+                window['-ANSWER-'].update('')
+                window['-EXPLANATION-'].update('')
+                window['Correct'].update(disabled=False)
+                window['Incorrect'].update(disabled=False)
+                window['Check'].update(disabled=False)
+                window['-IN-'].update(disabled=False)
+            continue
+
         if event == 'Incorrect':
             # If user is correct ('Incorrect' and generated incorrect):
             if not errors[error_num][1]:
@@ -212,13 +465,14 @@ async def build_practice(errors_in: List[str], base_window: sg.Window) -> None:
                 window['-ERR_MSG-'].update('')
                 # Display correct sentence
                 window['-ANSWER-'].update('This sentence is already correct.', text_color='light green')
+                window['-EXPLANATION-'].update(bundle.explanation)
                 if errors:
                     recurring_errors.append(errors[error_num])
+                    recurring_prefetched.append(None)
                 # If last exercise, reset errors[] and error_num to cycle through incorrect problems
                 if error_num == len(errors) - 1:
-                    random.shuffle(recurring_errors)
-                    errors = recurring_errors
-                    recurring_errors = []
+                    (errors, prefetched) = shuffle_cycle(recurring_errors, recurring_prefetched)
+                    (recurring_errors, recurring_prefetched) = ([], [])
                     error_num = -1
                     # If there were no more incorrect problems, make 'Next' button unclickable & invisible; make 'Exit' visible
                     if not errors:
@@ -251,11 +505,11 @@ async def build_practice(errors_in: List[str], base_window: sg.Window) -> None:
                 # Update '-RESULT-' text
                 window['-RESULT-'].update('Correct!', text_color='light green')
                 window['-ANSWER-'].update('This sentence is already correct.', text_color='light green')
+                window['-EXPLANATION-'].update(bundle.explanation)
                 # If last exercise, reset errors[] and error_num to cycle through incorrect problems
                 if error_num == len(errors) - 1:
-                    random.shuffle(recurring_errors)
-                    errors = recurring_errors
-                    recurring_errors = []
+                    (errors, prefetched) = shuffle_cycle(recurring_errors, recurring_prefetched)
+                    (recurring_errors, recurring_prefetched) = ([], [])
                     error_num = -1
                     # If there were no more incorrect problems, make 'Next' button unclickable & invisible; make 'Exit' visible
                     if not errors:
@@ -277,144 +531,66 @@ async def build_practice(errors_in: List[str], base_window: sg.Window) -> None:
                 if end_of_curr_cycle_flag:
                     cycling_again_flag = end_of_curr_cycle_flag
                     end_of_curr_cycle_flag = False
+                window['-P_REM-'].update(p_remaining)
+                window['-P_CORR-'].update(p_correct)
+                window['-P_INCORR-'].update(p_incorrect)
             # If user is incorrect ('Correct' but generated incorrect):
             else:
                 # Make '-IN-' field intangible (until next exercise)
                 window['-IN-'].update(disabled=True)
                 # Show answer
                 window['-RESULT-'].update('Incorrect', text_color='red')
-                # Generate correct sentence
-                correct_task = asyncio.create_task(gpt_tester.correct(errors[error_num][0], window=window))
-                try:
-                    (corr_sent, err_instr) = await correct_task
-                except asyncio.CancelledError:
-                    err_instr = "An error has occurred. Please try again."
-                # If error, display error message then go back to beginning of loop:
-                if err_instr != '':
-                    window['-ERR_MSG-'].update(err_instr, text_color='dark orange')
-                    # Makes 'Incorrect' and 'Correct' buttons clickable
-                    window['Correct'].update(disabled=False)
-                    window['Incorrect'].update(disabled=False)
-                    # Make '-IN-' field tangible
-                    window['-IN-'].update(disabled=False)
-                    continue
-                window['-ERR_MSG-'].update('')
-                # Display correct sentence
-                window['-ANSWER-'].update(corr_sent, text_color='light green')
-                # Explain
-                explain_error_task = asyncio.create_task(gpt_tester.explain_error(errors[error_num][0], window['-ANSWER-'].get(), window=window))
-                try:
-                    (explanation, err_instr) = await explain_error_task
-                except asyncio.CancelledError:
-                    err_instr = "An error has occurred. Please try again."
-                if err_instr != '':
-                    window['-ERR_MSG-'].update(err_instr, text_color='dark orange')
-                    # Makes 'Incorrect' and 'Correct' buttons clickable
-                    window['Correct'].update(disabled=False)
-                    window['Incorrect'].update(disabled=False)
-                    # Make '-IN-' field tangible
-                    window['-IN-'].update(disabled=False)
-                    continue
-                window['-ERR_MSG-'].update('')
-                # Displays explanation
-                window['-EXPLANATION-'].update(explanation)
-                if errors:
-                    recurring_errors.append(errors[error_num])
-                # If last exercise, reset errors[] and error_num to cycle through incorrect problems
-                if error_num == len(errors) - 1:
-                    random.shuffle(recurring_errors)
-                    errors = recurring_errors
-                    recurring_errors = []
-                    error_num = -1
-                    # If there were no more incorrect problems, make 'Next' button unclickable & invisible; make 'Exit' visible
-                    if not errors:
-                        window['Next'].update(disabled=True, visible=False)
-                        window['Exit'].update(visible=True)
-                    else:
-                        window['Next'].update(disabled=False)
-                        end_of_curr_cycle_flag = True
-                # If there is another exercise, make 'Next' button clickable
-                else:
-                    window['Next'].update(disabled=False)
-                if not cycling_again_flag:
-                    p_incorrect += 1
-                    p_remaining -= 1
-                if end_of_curr_cycle_flag:
-                    cycling_again_flag = end_of_curr_cycle_flag
-                    end_of_curr_cycle_flag = False
-            window['-P_REM-'].update(p_remaining)
-            window['-P_CORR-'].update(p_correct)
-            window['-P_INCORR-'].update(p_incorrect)
+                # Generate the correct sentence and explanation in the background (see '-ANSWERED-')
+                active_task = start_task(window, '-ANSWERED-', gpt_tester.in_action('Answer', answer_exercise(bundle, None, window)))
+                active_event = '-ANSWERED-'
+                window['Cancel'].update(disabled=False)
 
         # 'Check' button: Checks user answer (only clickable when supposed to)
         if event == 'Check':
             # If '-IN-' is empty or 'Check' button is invisible, don't do anything
             if window['-IN-'].get() == '' or not window['Check'].visible:
                 continue
-            else:
-                # Make '-IN-' field intangible (until next exercise)
-                window['-IN-'].update(disabled=True)
-                # Make 'Check' button unclickable (until user hits 'Next')
-                window['Check'].update(disabled=True)
-                is_correct_task = asyncio.create_task(gpt_tester.is_correct(window['-IN-'].get(), window=window))
-                try:
-                    (is_correct, err_instr) = await is_correct_task
-                except asyncio.CancelledError:
-                    err_instr = "An error has occurred. Please try again."
-                # If error, display error message then go back to beginning of loop:
-                if err_instr != '':
-                    window['-ERR_MSG-'].update(err_instr, text_color='dark orange')
-                    # Make '-IN-' field tangible
-                    window['-IN-'].update(disabled=False)
-                    # Make 'Check' button clickable
-                    window['Check'].update(disabled=False)
-                    continue
-                window['-ERR_MSG-'].update('')
+            # Make '-IN-' field intangible (until next exercise)
+            window['-IN-'].update(disabled=True)
+            # Make 'Check' button unclickable (until user hits 'Next')
+            window['Check'].update(disabled=True)
+            # Grade the answer in the background (see '-ANSWERED-')
+            active_task = start_task(window, '-ANSWERED-', gpt_tester.in_action('Answer', answer_exercise(bundle, window['-IN-'].get(), window)))
+            active_event = '-ANSWERED-'
+            window['Cancel'].update(disabled=False)
+
+        # The user's answer was graded ('Correct' on an incorrect sentence, or 'Check')
+        if event == '-ANSWERED-' and active_task != None:
+            active_task = None
+            window['Cancel'].update(disabled=True)
+            (is_correct, corr_sent, explanation, err_instr) = task_result(values[event], (False, '', ''))
+            # If error, display error message and let the user answer again, then go back to beginning of loop:
+            if err_instr != '':
+                window['-ERR_MSG-'].update(err_instr, text_color='dark orange')
+                window['-RESULT-'].update('')
+                # Makes 'Incorrect' and 'Correct' buttons clickable
+                window['Correct'].update(disabled=False)
+                window['Incorrect'].update(disabled=False)
+                # Make '-IN-' field tangible and 'Check' button clickable
+                window['-IN-'].update(disabled=False)
+                window['Check'].update(disabled=False)
+                continue
+            window['-ERR_MSG-'].update('')
 
             # If user is incorrect
             if not is_correct:
                 # Show answer
                 window['-RESULT-'].update('Incorrect', text_color='red')
-                # Generates the correct sentence
-                correct_task = asyncio.create_task(gpt_tester.correct(errors[error_num][0], window=window))
-                try:
-                    (corr_sent, err_instr) = await correct_task
-                except asyncio.CancelledError:
-                    err_instr = "An error has occurred. Please try again."
-                # If error, display error message then go back to beginning of loop:
-                if err_instr != '':
-                    window['-ERR_MSG-'].update(err_instr, text_color='dark orange')
-                    # Make '-IN-' field tangible
-                    window['-IN-'].update(disabled=False)
-                    # Make 'Check' button clickable
-                    window['Check'].update(disabled=False)
-                    continue
-                window['-ERR_MSG-'].update('')
-                # Displays correct sentence
+                # Displays correct sentence and explanation
                 window['-ANSWER-'].update(corr_sent, text_color='light green')
-                # Explain
-                explain_error_task = asyncio.create_task(gpt_tester.explain_error(window['-IN-'].get(), window['-ANSWER-'].get(), window=window))
-                try: 
-                    (explanation, err_instr) = await explain_error_task
-                except asyncio.CancelledError:
-                    err_instr = "An error has occurred. Please try again."
-                if err_instr != '':
-                    window['-ERR_MSG-'].update(err_instr, text_color='dark orange')
-                    # Make '-IN-' field tangible
-                    window['-IN-'].update(disabled=False)
-                    # Make 'Check' button clickable
-                    window['Check'].update(disabled=False)
-                    continue
-                window['-ERR_MSG-'].update('')
-                # Displays explanation
                 window['-EXPLANATION-'].update(explanation)
                 if errors:
                     recurring_errors.append(errors[error_num])
+                    recurring_prefetched.append(None)
                 # If last exercise, reset errors[] and error_num to cycle through incorrect problems
                 if error_num == len(errors) - 1:
-                    random.shuffle(recurring_errors)
-                    errors = recurring_errors
-                    recurring_errors = []
+                    (errors, prefetched) = shuffle_cycle(recurring_errors, recurring_prefetched)
+                    (recurring_errors, recurring_prefetched) = ([], [])
                     error_num = -1
                     # If there were no more incorrect problems, make 'Next' button unclickable & invisible; make 'Exit' visible
                     if not errors:
@@ -432,16 +608,14 @@ async def build_practice(errors_in: List[str], base_window: sg.Window) -> None:
                 if end_of_curr_cycle_flag:
                     cycling_again_flag = end_of_curr_cycle_flag
                     end_of_curr_cycle_flag = False
-            # If user is correct (generated correct & checked '-NO_ERROR-'; generated incorrect & submitted correct)
+            # If user is correct (generated incorrect & submitted correct)
             else:
-                window['-ERR_MSG-'].update('')
                 # Update '-RESULT-' text
                 window['-RESULT-'].update('Correct!', text_color='light green')
                 # If last exercise, reset errors[] and error_num to cycle through incorrect problems
                 if error_num == len(errors) - 1:
-                    random.shuffle(recurring_errors)
-                    errors = recurring_errors
-                    recurring_errors = []
+                    (errors, prefetched) = shuffle_cycle(recurring_errors, recurring_prefetched)
+                    (recurring_errors, recurring_prefetched) = ([], [])
                     error_num = -1
                     # If there were no more incorrect problems, make 'Next' button unclickable & invisible; make 'Exit' visible
                     if not errors:
@@ -464,51 +638,33 @@ async def build_practice(errors_in: List[str], base_window: sg.Window) -> None:
             window['-P_REM-'].update(p_remaining)
             window['-P_CORR-'].update(p_correct)
             window['-P_INCORR-'].update(p_incorrect)
-        
+
         # 'Next' button: Cycles to next exercise (only clickable when supposed to)
         if event == 'Next':
             # Make 'Next' button unclickable (until user hits 'Check')
             window['Next'].update(disabled=True)
             # Make '-IN-' input intangible
             window['-IN-'].update(disabled=True)
-            # Display next exercise (if there is one)
-            # If next sentence is correct, generates a correct sentence
-            if errors[error_num+1][1]:
-                if not cycling_again_flag:
-                    sent_idx = random.randint(0, len(example_sents)-1)
-                    gen_correct_task = asyncio.create_task(gpt_tester.gen_correct(example_sents[sent_idx], window=window))
-                else:
-                    gen_correct_task = asyncio.create_task(gpt_tester.gen_correct(errors[error_num+1][0], window=window))
-                try:
-                    (curr_exercise, err_instr) = await gen_correct_task
-                except asyncio.CancelledError:
-                    err_instr = "An error has occurred. Please try again."
-                # If error, display error (then build screen as normal)
-                if err_instr != '':
-                    window['-ERR_MSG-'].update(err_instr, text_color='dark orange')
-                    # Make 'Next' button clickable
-                    window['Next'].update(disabled=False)
-                    # Make '-IN-' input intangible
-                    window['-IN-'].update(disabled=False)
-                    continue
-                # If no error & first time through, remove example sentence from example_sents[]
-                elif not cycling_again_flag:
-                    del example_sents[sent_idx]
-            # If next sentence is incorrect, generates an incorrect sentence
-            else:
-                gen_incorrect_task = asyncio.create_task(gpt_tester.gen_incorrect(errors[error_num+1][0], window=window))
-                try: 
-                    (curr_exercise, err_instr) = await gen_incorrect_task
-                except asyncio.CancelledError:
-                    err_instr = "An error has occurred. Please try again."
-                if err_instr != '':
-                    window['-ERR_MSG-'].update(err_instr, text_color='dark orange')
-                    # Make 'Next' button clickable
-                    window['Next'].update(disabled=False)
-                    # Make '-IN-' input intangible
-                    window['-IN-'].update(disabled=False)
-                    continue
-                
+            # Use the prefetched exercise (only waits if it's still generating; see '-EXERCISE_READY-')
+            fill_prefetch(errors, prefetched, error_num, recurring_errors, recurring_prefetched)
+            active_task = start_task(window, '-EXERCISE_READY-', gpt_tester.in_action('Next', await_prefetched(prefetched[error_num+1], window)))
+            active_event = '-EXERCISE_READY-'
+            window['Cancel'].update(disabled=False)
+
+        # The next exercise is ready: Display it
+        if event == '-EXERCISE_READY-' and active_task != None:
+            active_task = None
+            window['Cancel'].update(disabled=True)
+            (bundle, err_instr) = task_result(values[event], (None,))
+            # If error, display error message, then start generating it again
+            if err_instr != '':
+                prefetched[error_num+1] = None
+                window['-ERR_MSG-'].update(err_instr, text_color='dark orange')
+                # Make 'Next' button clickable
+                window['Next'].update(disabled=False)
+                continue
+            window['-ERR_MSG-'].update('')
+
             # Clear '-ANSWER-' text
             window['-ANSWER-'].update('')
             # Clears '-RESULT-' text
@@ -520,8 +676,9 @@ async def build_practice(errors_in: List[str], base_window: sg.Window) -> None:
             # Clears '-IN-' input and makes it tangible
             window['-IN-'].update('')
             window['-IN-'].update(disabled=False)
-            # Update '-P_INFO-'
-            window['-P_INFO-'].update('Does this sentence contain any grammatical errors?')
+            # Update '-P_INFO-' (after the first exercise)
+            if error_num >= 0:
+                window['-P_INFO-'].update('Does this sentence contain any grammatical errors?')
             # Make 'B' and '-IN-' invisible
             window['B'].update(visible=False)
             window['-IN-'].update(visible=False)
@@ -535,8 +692,14 @@ async def build_practice(errors_in: List[str], base_window: sg.Window) -> None:
             window['-P_INCORR-'].update(p_incorrect)
 
             error_num += 1
-            errors[error_num] = (curr_exercise, errors[error_num][1])
-            window['-CURR_EXER-'].update(curr_exercise)            
+            # Keep errors[error_num] as the user's error it was made from (an exercise answered wrong is generated again from it next cycle); bundle holds the sentence shown
+            window['-CURR_EXER-'].update(bundle.sentence)
+
+    # Stop the call in flight and generating exercises that will never be shown
+    await cancel_task(active_task)
+    for task in prefetched + recurring_prefetched:
+        if task != None:
+            task.cancel()
 
     window.close()
 
@@ -557,18 +720,52 @@ def update_error(errors: List[str], corrected: List[str], error_num: int) -> str
     else:
         return 'No errors! Good job :)'
 
-def update_input_sample(text: List[str], err_num_to_highlight: int, window: sg.Window, multi_key: str) -> None:
-    window[multi_key].update('')
-    for i in range(0, len(text)):
-        # If correct chunk, append chunk normally
-        if i % 2 == 0:
-            window[multi_key].update(text[i], append=True)
-        # If incorrect chunk, check if should be highlighted, then append chunk in red (and highlighted, if desired)
-        else:
-            if i == 2*err_num_to_highlight+1:
-                window[multi_key].update(text[i], text_color_for_value='red', background_color_for_value='khaki', append=True)
-            else:
-                window[multi_key].update(text[i], text_color_for_value='red', append=True)
+def show_corrections(window: sg.Window, errors: List[str], corrected: List[str], error_num: int, checked=True) -> None:
+    # Shows errors[error_num] in '-ERRORS-' (e.g. again, after a streamed check was cancelled); nothing if the text was never checked
+    if not checked:
+        window['-C_INFO-'].update('Corrections:')
+        window['-ERRORS-'].update('')
+    elif errors:
+        window['-C_INFO-'].update(f'Corrections ({error_num+1}/{len(errors)}):')
+    else:
+        window['-C_INFO-'].update('Corrections (0/0):')
+    window['-ERRORS-'].update(update_error(errors, corrected, error_num))
+
+# ~ Functions to highlight errors in the writing sample ~ #
+def tk_index(offset: int) -> str:
+    # Tk text index of a character offset
+    return f'1.0+{offset}c'
+
+def highlight_errors(window: sg.Window, multi_key: str, spans: List[Tuple[int, int]]) -> None:
+    '''
+    Colors every error in window[multi_key] red (with Tk text tags, so the text itself isn't rewritten).\n
+    Takes in window, multi_key, spans[] ((start, end) character offsets of each error); returns nothing.\n
+    Error i is also tagged 'error_i', which keeps track of where it is if the text is edited.
+    '''
+    widget = window[multi_key].Widget
+    for tag in widget.tag_names():
+        if tag.startswith('error_'):
+            widget.tag_delete(tag)
+    widget.tag_config('error', foreground='red')
+    widget.tag_config('current_error', background='khaki')
+    widget.tag_remove('error', '1.0', 'end')
+    widget.tag_remove('current_error', '1.0', 'end')
+    for (i, (start, end)) in enumerate(spans):
+        widget.tag_add('error', tk_index(start), tk_index(end))
+        widget.tag_add(f'error_{i}', tk_index(start), tk_index(end))
+
+def highlight_current(window: sg.Window, multi_key: str, prev_num: int, error_num: int) -> None:
+    '''
+    Moves the highlight from error prev_num to error_num (two tag changes, however long the text is).\n
+    Takes in window, multi_key, prev_num (-1 if nothing is highlighted), error_num; returns nothing.
+    '''
+    widget = window[multi_key].Widget
+    prev_range = widget.tag_ranges(f'error_{prev_num}')
+    if prev_range:
+        widget.tag_remove('current_error', prev_range[0], prev_range[-1])
+    curr_range = widget.tag_ranges(f'error_{error_num}')
+    if curr_range:
+        widget.tag_add('current_error', curr_range[0], curr_range[-1])
 
 # ~ Function to build Main window ~ #
 async def build_SmartTutor():
@@ -597,27 +794,99 @@ async def build_SmartTutor():
     main_layout = [
         [sg.Menu(menu_def)],
         [sg.Column(text_input_column), sg.VSeparator(), sg.Column(errors_column, size=(250, 360), pad=(0,0))],
-        [sg.Button('Check'), sg.VSeparator(), sg.Button('Practice', disabled=True), sg.Push(), sg.Text('', size=(70, 1), text_color='dark orange', key='-ERR_MSG-'), sg.Push(), sg.Exit()]
+        [sg.Button('Check'), sg.Button('Cancel', disabled=True), sg.VSeparator(), sg.Button('Practice', disabled=True), sg.Push(), sg.Text('', size=(70, 1), text_color='dark orange', key='-ERR_MSG-'), sg.Push(), sg.Exit()]
     ]
 
-    window = sg.Window(title='LexEd', layout=main_layout, font=default_font, resizable=False)
+    window = sg.Window(title='LexEd', layout=main_layout, font=default_font, resizable=False, finalize=True)
+    startup_done(window)
+    await start_client()
 
+    # Saved key being verified in the background (if it's due)
+    key_task = verify_saved_key(window)
+    # Per-sentence results of the last check (to only re-check what changed)
+    sentence_results = []
     # List of errors[] and corrected[]
     errors, corrected = [], []
     # List of explanations
     explanations = []
     # Error number in the list (to keep track of through button presses)
     error_num = 0
+    # Check running in the background
+    check_task = None
+    # Explanation currently streaming (and which error it's for)
+    explain_task = None
+    explain_num = 0
+    # Explanations warmed up in the background (by error + correction), the tasks still fetching them, and how many were started this session
+    warmed_up = {}
+    warm_up_tasks = {}
+    # Warm-ups whose call has been sent (not still queued behind other background calls)
+    warm_up_dispatched = set()
+    warm_ups = 0
     
     # Main loop
     while True:
-        event, values = window.read()
+        event, values = await read_window(window)
         if event in (sg.WIN_CLOSED, 'Exit'):
             break
 
         if event == 'Change API Key':
             change_api_key = True
             break
+
+        # The saved key was verified in the background
+        if event == '-KEY_VERIFIED-' and key_task != None:
+            key_task = None
+            (is_valid_key, err_instr) = task_result(values[event], (False,))
+            # If valid, don't verify it again until KEY_VERIFY_TTL is up
+            if is_valid_key:
+                save_credentials(load_credentials()[0], time.time())
+            # If OpenAI couldn't be reached, keep using it (it's verified again next launch); if it was rejected, ask for a new one
+            elif err_instr not in OPENAI_PROB_ERR_MSGS:
+                window['-ERR_MSG-'].update(f'{err_instr} (Settings > Change API Key)', text_color='dark orange')
+
+        # 'Cancel' button: Abort the check and/or explanation in flight (only clickable while there is one)
+        if event == 'Cancel':
+            if check_task != None:
+                await cancel_task(check_task)
+                check_task = None
+                window['-WRITING_INPUT-'].update(disabled=False)
+                window['Check'].update(disabled=False)
+                # Go back to showing the last check
+                show_corrections(window, errors, corrected, error_num, checked=sentence_results != [])
+            if explain_task != None:
+                await cancel_task(explain_task)
+                explain_task = None
+                window['-EXPLANATION-'].update('')
+                window['Explain'].update(disabled=False)
+            window['Cancel'].update(disabled=True)
+            window['-ERR_MSG-'].update('Cancelled.', text_color='dark orange')
+
+        # Stop streaming the explanation if the user moves on (it can be explained again later)
+        if event in ('<', '>', 'Check') and explain_task != None:
+            await cancel_task(explain_task)
+            explain_task = None
+            window['Cancel'].update(disabled=check_task == None and explain_task == None)
+
+        # The explanation finished streaming: Save it
+        if event == '-EXPLAINED-' and explain_task != None:
+            explain_task = None
+            window['Cancel'].update(disabled=check_task == None and explain_task == None)
+            (explanation, err_instr) = task_result(values[event], ('',))
+            # If error, display error and make 'Explain' clickable again
+            if err_instr != '':
+                window['-ERR_MSG-'].update(err_instr, text_color='dark orange')
+                window['-EXPLANATION-'].update('')
+                window['Explain'].update(disabled = False)
+            else:
+                explanations[explain_num] = explanation
+                window['-ERR_MSG-'].update('')
+                window['-EXPLANATION-'].update(explanation, text_color='white')
+        
+        # A warmed-up explanation landed: Keep it for when the user clicks 'Explain'
+        if event == '-WARMED_UP-' and values[event] in warm_up_tasks:
+            task = warm_up_tasks.pop(values[event])
+            if task.exception() == None and task.result()[1] == '':
+                warmed_up[values[event]] = task.result()[0]
         
         # CHECK AND CORRECT
 
@@ -627,23 +896,44 @@ async def build_SmartTutor():
 
         # 'Check' button: Check writing sample
         if event == 'Check':
-            
-            if '|' in window['-WRITING_INPUT-'].get():
-                window['-ERR_MSG-'].update("Input cannot contain '|'", text_color='dark orange')
-                continue
-            # Make 'Check' button unclickable (until '-WRITING_INPUT-' is changed)
+            # Make 'Check' button unclickable (until the check finishes or '-WRITING_INPUT-' is changed)
             window['Check'].update(disabled=True)
-            # If 'Check' button is clicked, reset errors[], corrected[], and explanations[]
-            check_task = asyncio.create_task(gpt_tester.check(window['-WRITING_INPUT-'].get(), window=window))
-            try:
-                (errors, corrected, err_instr) = await check_task
-            except asyncio.CancelledError:
-                err_instr = "An error has occurred. Please try again."
+            # Make '-WRITING_INPUT-' intangible while it's being checked
+            window['-WRITING_INPUT-'].update(disabled=True)
+            # Only re-check the sentences that were added/changed since the last check, in the background (see '-CHECKED-')
+            # New corrections show up in '-ERRORS-' as soon as their sentences are checked
+            window['-C_INFO-'].update('Corrections (checking...):')
+            check_task = start_task(window, '-CHECKED-', gpt_tester.in_action('Check', gpt_tester.recheck(window['-WRITING_INPUT-'].get(), sentence_results, window=window, on_result=stream_corrections(window, '-ERRORS-'))))
+            window['Cancel'].update(disabled=False)
+
+        # The check finished: Display the errors
+        if event == '-CHECKED-' and check_task != None:
+            check_task = None
+            window['Cancel'].update(disabled=check_task == None and explain_task == None)
+            window['-WRITING_INPUT-'].update(disabled=False)
+            (new_results, err_instr) = task_result(values[event], ([],))
+            # Rebuild errors[] and corrected[] (in order, with where each error is in the text) from the results
+            (new_errors, new_corrected, new_spans) = ([], [], [])
+            for result in new_results:
+                if result != None and result.has_error:
+                    new_errors.append(result.sentence)
+                    new_corrected.append(result.corrected)
+                    new_spans.append((result.start, result.end))
             if err_instr != '':
                 window['-ERR_MSG-'].update(err_instr, text_color='dark orange')
                 window['Check'].update(disabled=False)
-                continue
-            window['-ERR_MSG-'].update('')
+                # If no errors came back, keep the last check and go to beginning of loop; otherwise show the partial results
+                if not new_errors:
+                    show_corrections(window, errors, corrected, error_num, checked=sentence_results != [])
+                    continue
+            else:
+                window['-ERR_MSG-'].update('')
+            # Remember explanations that were already fetched (by error + correction) so they survive the re-check
+            explained = {}
+            for i in range(0, len(explanations)):
+                if explanations[i] != '':
+                    explained[(errors[i], corrected[i])] = explanations[i]
+            (sentence_results, errors, corrected) = (new_results, new_errors, new_corrected)
 
             # Sets to first error in sample whenever 'Check' button is clicked
             error_num = 0
@@ -654,31 +944,27 @@ async def build_SmartTutor():
                 window['-C_INFO-'].update('Corrections (0/0):')
 
             explanations = []
-            temp_writing_input = window['-WRITING_INPUT-'].get()
-            new_writing_input = []
-            
-            # Set new_writing_input[] as list of chunks [correct, incorrect, correct, incorrect, ... , correct] (for easily red-texting incorrect)
-            for i in range(0, len(errors)):
-                # start idx of error
-                curr_err_idx = temp_writing_input.find(errors[i])
-                # add correct stuff (before curr error)
-                new_writing_input.append(temp_writing_input[:curr_err_idx])
-                # sample now starts at the end of curr error
-                temp_writing_input = temp_writing_input[curr_err_idx+len(errors[i]):]
-                # add curr error (+ ' ')
-                new_writing_input.append(errors[i])
-            # add correct stuff (after last error)
-            new_writing_input.append(temp_writing_input)
-            update_input_sample(new_writing_input, error_num, window, '-WRITING_INPUT-')
-
-            # I am. He are. I am. He are. He are. He are. He are. He are. He are.
+
+            # Color the errors in '-WRITING_INPUT-' and highlight the first one
+            highlight_errors(window, '-WRITING_INPUT-', new_spans)
+            highlight_current(window, '-WRITING_INPUT-', -1, error_num)
 
             # Makes 'Practice' button clickable
             window['Practice'].update(disabled=False)
 
-            # Makes explanations[] the same length as errors[]
-            for error in errors:
-                explanations.append('')
+            # Makes explanations[] the same length as errors[] (re-mapping explanations of unchanged errors to their new positions)
+            for i in range(0, len(errors)):
+                explanations.append(explained.get((errors[i], corrected[i]), ''))
+
+            # Stop warming up explanations of errors that are gone, then warm up the new ones (up to WARM_UP_LIMIT per session)
+            for pair in list(warm_up_tasks):
+                if pair not in zip(errors, corrected):
+                    warm_up_tasks.pop(pair).cancel()
+            for i in range(0, len(errors)):
+                pair = (errors[i], corrected[i])
+                if explanations[i] == '' and pair not in warmed_up and pair not in warm_up_tasks and warm_ups < WARM_UP_LIMIT:
+                    warm_up_tasks[pair] = warm_up_explanation(errors[i], corrected[i], window, warm_up_dispatched)
+                    warm_ups += 1
             # Makes 'Explain' button clickable if there are errors
             if errors:
                 window['Explain'].update(disabled=False)
@@ -695,6 +981,8 @@ async def build_SmartTutor():
             if errors:
                 window['-EXPLANATION-'].update(explanations[error_num])
 
+            # Back to the first error
+            window['<'].update(disabled=True)
             # If there is more than 1 error, let user cycle to next error
             if len(errors) > 1:
                 window['>'].update(disabled=False)
@@ -703,6 +991,7 @@ async def build_SmartTutor():
 
         # '<' button: Previous error (only clickable when supposed to)
         if event == '<':
+            prev_num = error_num
             # Make '>' button clickable when going to previous error
             window['>'].update(disabled=False)
             # If second error, go to first error and then make '<' button unclickable
@@ -714,7 +1003,7 @@ async def build_SmartTutor():
                 error_num -= 1
                 window['<'].update(disabled=False)
             # Highlight correct error in '-WRITING_INPUT-'
-            update_input_sample(new_writing_input, error_num, window, '-WRITING_INPUT-')
+            highlight_current(window, '-WRITING_INPUT-', prev_num, error_num)
             # Display correct correction number
             window['-C_INFO-'].update(f'Corrections ({error_num+1}/{len(errors)}):')
             # Display correct error
@@ -733,6 +1022,7 @@ async def build_SmartTutor():
             window['-EXPLANATION-'].update(explanations[error_num])
         # '>' button: Next error (only clickable when supposed to)
         if event == '>':
+            prev_num = error_num
             # Make '<' button clickable when going to next error
             window['<'].update(disabled=False)
             # If second-to-last error, go to last error and then make '>' button unclickable
@@ -744,7 +1034,7 @@ async def build_SmartTutor():
                 error_num += 1
                 window['>'].update(disabled=False)
             # Highlight correct error in '-WRITING_INPUT-'
-            update_input_sample(new_writing_input, error_num, window, '-WRITING_INPUT-')
+            highlight_current(window, '-WRITING_INPUT-', prev_num, error_num)
             # Display correct correction number
             window['-C_INFO-'].update(f'Corrections ({error_num+1}/{len(errors)}):')
             # Display correct error
@@ -768,19 +1058,28 @@ async def build_SmartTutor():
         if event == 'Explain':
             # If 'Explain' buttton is clicked, make it unclickable (until cycling to the next error)
             window['Explain'].update(disabled = True)
-            # Generate explanation
-            explain_error_task = asyncio.create_task(gpt_tester.explain_error(errors[error_num], corrected[error_num], window=window))
-            try:
-                (explanations[error_num], err_instr) = await explain_error_task
-            except asyncio.CancelledError:
-                err_instr = "An error has occurred. Please try again."
-            # If error, display error and then go to beginning of loop
-            if err_instr != '':
-                window['-ERR_MSG-'].update(err_instr, text_color='dark orange')
-                window['Explain'].update(disabled = False)
+            pair = (errors[error_num], corrected[error_num])
+            # If the explanation was already warmed up, show it right away
+            if pair in warmed_up:
+                explanations[error_num] = warmed_up[pair]
+                window['-ERR_MSG-'].update('')
+                window['-EXPLANATION-'].update(explanations[error_num], text_color='white')
                 continue
-            window['-ERR_MSG-'].update('')
-            window['-EXPLANATION-'].update(explanations[error_num], text_color='white')
+            # If it's still waiting in the background queue, drop it and ask right away in the interactive lane (below)
+            if pair in warm_up_tasks and pair not in warm_up_dispatched:
+                warm_up_tasks.pop(pair).cancel()
+            # If it's already been sent, wait for it instead of asking again
+            if pair in warm_up_tasks:
+                window['-EXPLANATION-'].update('', text_color='white')
+                explain_num = error_num
+                explain_task = start_task(window, '-EXPLAINED-', gpt_tester.in_action('Explain', await_prefetched(asyncio.shield(warm_up_tasks[pair]), window)))
+                window['Cancel'].update(disabled=False)
+                continue
+            # Generate explanation in the background, streaming it into '-EXPLANATION-' (saved once it finishes)
+            window['-EXPLANATION-'].update('', text_color='white')
+            explain_num = error_num
+            explain_task = start_task(window, '-EXPLAINED-', gpt_tester.in_action('Explain', gpt_tester.explain_error(errors[error_num], corrected[error_num], window=window, on_token=stream_into(window, '-EXPLANATION-'))))
+            window['Cancel'].update(disabled=False)
 
         # EXERCISES
 
@@ -789,6 +1088,13 @@ async def build_SmartTutor():
             await build_practice(errors, window)
             window['-ERR_MSG-'].update('')
 
+    # Stop the check and explanation in flight before the window goes away
+    await cancel_task(check_task)
+    await cancel_task(explain_task)
+    await cancel_task(key_task)
+    for task in warm_up_tasks.values():
+        task.cancel()
+
     window.close()
 
     if change_api_key:
@@ -796,8 +1102,17 @@ async def build_SmartTutor():
 
 # ~ Main function ~ #
 async def main():
-    if await build_intro():
-        await build_SmartTutor()
+    set_icon()
+    # One pooled connection to OpenAI for the whole session (opened once the first window is up; see start_client())
+    try:
+        if await build_intro():
+            await build_SmartTutor()
+    finally:
+        if gpt_tester.client != None:
+            await gpt_tester.client.close()
+        # If LEXED_TRACE is set, save the session's trace there (Chrome trace-event JSON, plus a summary)
+        if os.environ.get('LEXED_TRACE') and gpt_tester.tracer != None:
+            gpt_tester.tracer.export(os.environ['LEXED_TRACE'])
 
 if __name__ == '__main__':
     asyncio.run(main())
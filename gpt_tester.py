@@ -1,12 +1,515 @@
-import openai
 import asyncio
-import PySimpleGUI as sg
-from typing import Tuple, List
-import nltk
-nltk.download('punkt')
-from nltk.tokenize import sent_tokenize
+import contextvars
+import importlib.util
+import json
+import os
+import sys
+import time
+import difflib
+import re
+from typing import Tuple, List, Optional, NamedTuple
+import response_cache
+import scheduler
+import prescreen
+import tracing
+import routing
+import hedging
 
-async def loading_bar(window: sg.Window = None, key: str ='-ERR_MSG-'):
+def lazy_import(name: str):
+    '''
+    Imports module name, but only runs it the first time one of its attributes is used (so slow imports don't hold up startup).\n
+    Takes in name; returns the module.
+    '''
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+# openai (and aiohttp, which it imports) take a while to import, so they're only loaded once the first call is made
+openai = lazy_import('openai')
+aiohttp = lazy_import('aiohttp')
+
+# Models used for quick checks/explanations and for generating practice sentences
+FAST_MODEL = 'gpt-3.5-turbo'
+STRONG_MODEL = 'gpt-4'
+# Models tried for each call type, in order (a call only escalates to the next model if the response fails validation; see call_routed())
+ROUTES = {
+    'verify_key': [FAST_MODEL],
+    'is_correct': [FAST_MODEL],
+    'correct': [FAST_MODEL],
+    'explain_error': [FAST_MODEL],
+    'check_batch': [FAST_MODEL],
+    'gen_incorrect.concept': [FAST_MODEL],
+    'gen_incorrect': [FAST_MODEL, STRONG_MODEL],
+    'gen_correct': [FAST_MODEL, STRONG_MODEL],
+    'gen_exercise_bundle': [FAST_MODEL, STRONG_MODEL]
+}
+# Call types that may be hedged (the ones a user is waiting on; see send_hedged())
+HEDGED_CALL_TYPES = ['is_correct', 'correct', 'explain_error', 'check_batch', 'gen_incorrect.concept', 'gen_incorrect', 'gen_correct', 'gen_exercise_bundle']
+
+# Sentence tokenizer: 'punkt' (nltk) or 'simple' (built-in splitter, doesn't import nltk at all)
+TOKENIZER = os.environ.get('LEXED_TOKENIZER', 'punkt')
+# Where nltk data is looked up first (and downloaded to, the first time it's needed)
+NLTK_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'nltk_data')
+
+# Max number of sentences checked at the same time
+MAX_CONCURRENCY = 8
+# Number of sentences checked per call in batched mode (1 = one is_correct/correct call pair per sentence)
+BATCH_SIZE = 10
+
+# Max number of open connections to OpenAI
+POOL_SIZE = 20
+# Seconds an idle connection is kept open for reuse
+KEEPALIVE_TIMEOUT = 60
+# Seconds to wait for a connection / for a whole request
+CONNECT_TIMEOUT = 10
+REQUEST_TIMEOUT = 60
+
+class OpenAIClient:
+    '''
+    Owns the pooled, keep-alive HTTP session that every call to OpenAI goes through.\n
+    Create it once, start() it before making calls and close() it on exit.
+    '''
+
+    def __init__(self, pool_size=POOL_SIZE, keepalive_timeout=KEEPALIVE_TIMEOUT, connect_timeout=CONNECT_TIMEOUT, request_timeout=REQUEST_TIMEOUT):
+        self.pool_size = pool_size
+        self.keepalive_timeout = keepalive_timeout
+        self.connect_timeout = connect_timeout
+        self.request_timeout = request_timeout
+        self.session = None
+        self.requests = 0
+        self.connections_created = 0
+        self.connections_reused = 0
+
+    async def _on_request_start(self, session, trace_config_ctx, params) -> None:
+        self.requests += 1
+
+    async def _on_connection_create_end(self, session, trace_config_ctx, params) -> None:
+        self.connections_created += 1
+
+    async def _on_connection_reuseconn(self, session, trace_config_ctx, params) -> None:
+        self.connections_reused += 1
+
+    async def start(self) -> None:
+        '''
+        Opens the session and makes openai use it (for the current task and every task it creates).
+        '''
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(self._on_request_start)
+        trace_config.on_connection_create_end.append(self._on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(self._on_connection_reuseconn)
+        connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=self.keepalive_timeout)
+        self.session = aiohttp.ClientSession(connector=connector, trace_configs=[trace_config])
+        openai.aiosession.set(self.session)
+
+    async def close(self) -> None:
+        '''
+        Closes the session (and every pooled connection).
+        '''
+        if self.session != None:
+            openai.aiosession.set(None)
+            await self.session.close()
+            self.session = None
+
+    def timeout(self) -> Tuple[float, float]:
+        '''
+        Returns the (connect, total) timeout passed to each request.
+        '''
+        return (self.connect_timeout, self.request_timeout)
+
+    def stats(self) -> dict:
+        '''
+        Returns request and connection counters, and the fraction of requests that reused a pooled connection.
+        '''
+        return {
+            'requests': self.requests,
+            'connections_created': self.connections_created,
+            'connections_reused': self.connections_reused,
+            'reuse_rate': self.connections_reused / self.requests if self.requests else 0.0
+        }
+
+# Client shared by every call (set up in display.main())
+client = None
+
+# API key of the current task's calls (e.g. one per server request); None uses the global openai.api_key
+request_api_key = contextvars.ContextVar('request_api_key', default=None)
+
+class OpenAIBackend:
+    '''
+    Backend that sends chat completions to the OpenAI API, or to anything serving the same HTTP API at api_base (e.g. mock_server.py).\n
+    Any other backend needs the same chat() method, and has to raise openai.error exceptions so call_openai() can handle them.
+    '''
+
+    def __init__(self, api_base=None):
+        self.api_base = api_base
+
+    async def chat(self, model_name: str, messages: List[dict], temp, max_tok, stream=False, request_timeout=None):
+        '''
+        Sends one chat completion request, with the current task's API key (see request_api_key), or openai.api_key if it has none.\n
+        Takes in model_name, messages[], temp, max_tok, stream, request_timeout; returns the response (or an async generator of chunks if stream).
+        '''
+        return await openai.ChatCompletion.acreate(
+                    model = model_name,
+                    messages = messages,
+                    temperature = temp,
+                    max_tokens = max_tok,
+                    top_p = 0,
+                    stream = stream,
+                    request_timeout = request_timeout,
+                    api_base = self.api_base,
+                    api_key = request_api_key.get()
+                )
+
+# Backend every call goes through (set LEXED_API_BASE to use a different server, e.g. mock_server.py)
+backend = OpenAIBackend(api_base=os.environ.get('LEXED_API_BASE'))
+# Where the response cache and pre-screen are kept: on disk for OpenAI, in memory for any other backend (so e.g. mock answers are never served against OpenAI)
+STORE_ON_DISK = backend.api_base == None
+
+def is_retryable(e: Exception) -> bool:
+    # Errors worth retrying (the request may well work a bit later)
+    return isinstance(e, (openai.error.Timeout, openai.error.APIError, openai.error.APIConnectionError, openai.error.RateLimitError, openai.error.ServiceUnavailableError, openai.error.TryAgain))
+
+# Scheduler every call goes through (rate limit budgets per model + retries + priority lanes); None sends calls straight away
+request_scheduler = scheduler.RequestScheduler()
+
+# Lane of the current task's calls (interactive unless started with in_lane())
+INTERACTIVE = scheduler.INTERACTIVE
+BACKGROUND = scheduler.BACKGROUND
+current_lane = contextvars.ContextVar('current_lane', default=INTERACTIVE)
+
+async def in_lane(lane: str, coro):
+    '''
+    Runs coro with every call it makes in lane (e.g. asyncio.create_task(in_lane(BACKGROUND, gen_correct(...)))).\n
+    Takes in lane, coro; returns coro's result.
+    '''
+    token = current_lane.set(lane)
+    try:
+        return await coro
+    finally:
+        # Awaited directly (not in its own task), so the caller's later calls go back to its own lane
+        current_lane.reset(token)
+
+# Called (with the seconds queued) whenever a request of the current task leaves the scheduler's queue (see listen_for_dispatch())
+dispatch_listener = contextvars.ContextVar('dispatch_listener', default=None)
+
+def listen_for_dispatch(callback) -> None:
+    '''
+    Calls callback(seconds queued) whenever a request made by the current task (or a task it creates from now on) is actually sent, e.g. to tell whether a background call is still waiting for its turn.
+    '''
+    dispatch_listener.set(callback)
+
+async def send_request(model_name: str, messages: List[dict], temp, max_tok, stream=False, call_site='', on_dispatch=None):
+    '''
+    Sends one request to the backend, through request_scheduler (waiting for its turn in the current lane and for rate limit budget, and retrying transient errors) if there is one.\n
+    Takes in model_name, messages[], temp, max_tok, stream, call_site, on_dispatch(seconds queued) (called each time the request leaves the queue); returns the backend's response.
+    '''
+    request_timeout = client.timeout() if client != None else None
+    send = lambda: backend.chat(model_name, messages, temp, max_tok, stream=stream, request_timeout=request_timeout)
+    # Record time spent queued (and the number of attempts) on the call's span
+    span = tracing.current_span.get()
+    listener = dispatch_listener.get()
+    dispatched = [time.perf_counter()]
+    def dispatch(waited: float) -> None:
+        dispatched[0] = time.perf_counter()
+        if span != None:
+            span.attrs['queue_wait'] = span.attrs.get('queue_wait', 0.0) + waited
+            span.attrs['attempts'] = span.attrs.get('attempts', 0) + 1
+        if on_dispatch != None:
+            on_dispatch(waited)
+        if listener != None:
+            listener(waited)
+    if request_scheduler == None:
+        dispatch(0.0)
+        output = await send()
+    else:
+        tokens = sum(count_tokens(message['content']) for message in messages) + max_tok
+        output = await request_scheduler.run(model_name, tokens, send, is_retryable, lambda e: isinstance(e, openai.error.RateLimitError), lane=current_lane.get(), on_dispatch=dispatch)
+    # Measure the model's latency on this call type (from when the request left the queue, so rate limit waits don't count)
+    if router != None and not stream:
+        router.observe(model_name, call_site, time.perf_counter() - dispatched[0])
+    return output
+
+# Records a span per call (nested under the user action it's part of, see in_action()); None turns tracing off
+tracer = tracing.Tracer()
+
+async def in_action(name: str, coro):
+    '''
+    Runs coro as the user action name (e.g. 'Check'), so every call it makes is traced under it.\n
+    Takes in name, coro; returns coro's result.
+    '''
+    if tracer == None:
+        return await coro
+    return await tracer.run(name, coro)
+
+# Picks the model for each call type and records how each model does (see call_routed()); None always uses the last (strongest) model of each route
+router = routing.Router(ROUTES)
+
+# Sends a duplicate of interactive requests slower than usual (see send_hedged()); off unless LEXED_HEDGE=1
+hedger = hedging.Hedger(HEDGED_CALL_TYPES) if os.environ.get('LEXED_HEDGE') == '1' else None
+
+def can_send_now(model_name: str, messages: List[dict], max_tok) -> bool:
+    # Whether a request could leave request_scheduler's queue straight away (without waiting for rate limit budget)
+    if request_scheduler == None:
+        return True
+    budget = request_scheduler.budget(model_name)
+    tokens = sum(count_tokens(message['content']) for message in messages) + max_tok
+    return budget.requests.wait_time(1) == 0 and budget.tokens.wait_time(tokens) == 0
+
+def first_token_type(call_site: str) -> str:
+    # Call type the router learns time to first token of call_site's streamed calls under
+    return f'{call_site}.first_token'
+
+async def open_stream(model_name: str, messages: List[dict], temp, max_tok, call_site='', on_dispatch=None):
+    '''
+    Sends one streamed request and waits for its first token (learning the model's time to first token for call_site, from when the request left the queue).\n
+    Takes in model_name, messages[], temp, max_tok, call_site, on_dispatch; returns (output, tokens[]): the rest of the stream, and the tokens already read from it.
+    '''
+    dispatched = [time.perf_counter()]
+    def dispatch(waited: float) -> None:
+        dispatched[0] = time.perf_counter()
+        if on_dispatch != None:
+            on_dispatch(waited)
+    output = await send_request(model_name, messages, temp, max_tok, stream=True, call_site=call_site, on_dispatch=dispatch)
+    tokens = []
+    try:
+        async for chunk in output:
+            token = chunk['choices'][0]['delta'].get('content', '')
+            if token != '':
+                tokens.append(token)
+                break
+    except BaseException:
+        await output.aclose()
+        raise
+    if router != None:
+        router.observe(model_name, first_token_type(call_site), time.perf_counter() - dispatched[0])
+    return (output, tokens)
+
+async def send_hedged(model_name: str, messages: List[dict], temp, max_tok, call_site='', stream=False):
+    '''
+    Sends one request; if hedger is on and it takes longer than usual for model_name and call_site (interactive lane only), sends a duplicate and uses whichever finishes first, cancelling the other.\n
+    Takes in model_name, messages[], temp, max_tok, call_site, stream; returns the backend's response, or if stream, (output, tokens[]) from open_stream().\n
+    Streamed requests are hedged on time to first token: the first stream to start is used, and the other is closed.\n
+    Only the winner's usage is counted (the loser is cancelled before it reports any).
+    '''
+    send = open_stream if stream else send_request
+    delay = None
+    if hedger != None and router != None and current_lane.get() == INTERACTIVE:
+        delay = hedger.delay(call_site, router.latency(model_name, first_token_type(call_site) if stream else call_site, hedger.percentile, hedger.min_samples))
+    if delay == None:
+        return await send(model_name, messages, temp, max_tok, call_site=call_site)
+
+    dispatched = asyncio.Event()
+    primary = asyncio.create_task(send(model_name, messages, temp, max_tok, call_site=call_site, on_dispatch=lambda waited: dispatched.set()))
+    dispatch_waiter = asyncio.create_task(dispatched.wait())
+    tasks = {primary, dispatch_waiter}
+    winner = primary
+    try:
+        # Only start the clock once the request has left the queue (a hedge would wait in the same queue)
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        (done, pending) = await asyncio.wait({primary}, timeout=delay)
+        # If it came back in time (or a hedge would have to wait for rate limit budget, or there's no hedge budget left), just use it
+        if done or not can_send_now(model_name, messages, max_tok) or not hedger.fire():
+            return await primary
+        hedge = asyncio.create_task(send(model_name, messages, temp, max_tok, call_site=call_site))
+        tasks.add(hedge)
+        span = tracing.current_span.get()
+        if span != None:
+            span.attrs['hedged'] = True
+        # First successful response wins (if one fails, wait for the other)
+        pending = {primary, hedge}
+        while True:
+            (done, pending) = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() == None:
+                    winner = task
+                    if task is hedge:
+                        hedger.won += 1
+                        if span != None:
+                            span.attrs['hedge_won'] = True
+                    return task.result()
+            # If both failed, raise the first request's error
+            if not pending:
+                return primary.result()
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+            # Close a losing stream that had already started
+            elif stream and task is not winner and task is not dispatch_waiter and not task.cancelled() and task.exception() == None:
+                await task.result()[0].aclose()
+
+# Cache of deterministic responses (is_correct, correct, explain_error, ...); None turns caching off
+cache = response_cache.ResponseCache(path=response_cache.CACHE_PATH if STORE_ON_DISK else ':memory:')
+
+# Local filter that passes sentences already confirmed correct without a model call (anything with screen(sentence) and confirm(sentences[])); None sends every sentence to the model
+# LEXED_PRESCREEN_SCORE=1 also passes sentences made only of word pairs seen in confirmed-correct sentences (see prescreen.PreScreen)
+screener = prescreen.PreScreen(path=prescreen.PRESCREEN_PATH if STORE_ON_DISK else ':memory:', use_score=os.environ.get('LEXED_PRESCREEN_SCORE') == '1')
+
+# Requests in flight (by response_cache.make_key() and API key), shared by identical calls made while they're running
+in_flight = {}
+# How many requests were sent through send_shared() (leaders) / reused an identical one in flight (followers)
+single_flight = {'leaders': 0, 'followers': 0}
+
+async def send_shared(flight_key, model_name: str, messages: List[dict], temp, max_tok, call_site='') -> Tuple[dict, bool]:
+    '''
+    Sends a (non-streamed) request (see send_hedged()), unless an identical one is already in flight, in which case its response is shared.\n
+    Takes in flight_key, model_name, messages[], temp, max_tok, call_site; returns (output, shared). shared is True if another call's request was reused.\n
+    The request is only cancelled once every call waiting on it is.
+    '''
+    shared = flight_key in in_flight
+    if shared:
+        flight = in_flight[flight_key]
+        single_flight['followers'] += 1
+    else:
+        flight = {'task': asyncio.create_task(send_hedged(model_name, messages, temp, max_tok, call_site)), 'waiters': 0}
+        in_flight[flight_key] = flight
+        def on_done(task: asyncio.Task) -> None:
+            if in_flight.get(flight_key) is flight:
+                del in_flight[flight_key]
+        flight['task'].add_done_callback(on_done)
+        single_flight['leaders'] += 1
+    flight['waiters'] += 1
+    try:
+        return (await asyncio.shield(flight['task']), shared)
+    finally:
+        flight['waiters'] -= 1
+        # If every call gave up on it, stop the request (later calls send their own)
+        if flight['waiters'] == 0 and not flight['task'].done():
+            flight['task'].cancel()
+            if in_flight.get(flight_key) is flight:
+                del in_flight[flight_key]
+
+# Usage counters of the current task and every task it creates (see track_usage())
+usage_counters = contextvars.ContextVar('usage_counters', default=None)
+
+def track_usage() -> dict:
+    '''
+    Starts counting calls and tokens made by the current task (and every task it creates from now on).\n
+    Returns the counters: calls (actually sent), cached (answered from the cache), deduped (shared an identical call in flight), failed, prompt_tokens, completion_tokens, screened (sentences the pre-screen passed without a call).
+    '''
+    counters = {'calls': 0, 'cached': 0, 'deduped': 0, 'failed': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'screened': 0}
+    usage_counters.set(counters)
+    return counters
+
+def count_tokens(text: str) -> int:
+    # Rough estimate (~4 characters per token) for when the response has no usage info (e.g. streaming)
+    return len(text) // 4 + 1
+
+# Abbreviations the simple tokenizer doesn't end sentences on
+ABBREVIATIONS = {'mr', 'mrs', 'ms', 'dr', 'prof', 'sr', 'jr', 'st', 'vs', 'etc', 'e.g', 'i.e', 'inc', 'ltd', 'co', 'corp', 'no', 'approx', 'dept', 'est', 'u.s'}
+# Candidate sentence ends: punctuation (plus closing quotes/brackets) followed by whitespace
+SENTENCE_END = re.compile(r'[.!?]+["\')\]]*(?=\s+|$)')
+
+def simple_span_tokenize(text: str) -> List[Tuple[int, int]]:
+    '''
+    Pure-Python sentence splitter (no nltk needed).\n
+    Takes in text; returns spans[] ((start, end) character offsets of each sentence in text, without surrounding whitespace).
+    '''
+    spans = []
+    start = 0
+    for match in SENTENCE_END.finditer(text):
+        # Don't split after abbreviations (e.g. 'Mr.') or initials (e.g. 'J.')
+        words = text[start:match.start()].split()
+        last_word = words[-1].lower() if words else ''
+        if match.group().startswith('.') and (last_word in ABBREVIATIONS or (len(last_word) == 1 and last_word.isalpha())):
+            continue
+        add_span(text, start, match.end(), spans)
+        start = match.end()
+    add_span(text, start, len(text), spans)
+    return spans
+
+def add_span(text: str, start: int, end: int, spans: List[Tuple[int, int]]) -> None:
+    # Appends text[start:end] (trimmed of whitespace) to spans[], unless it's blank
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end-1].isspace():
+        end -= 1
+    if start < end:
+        spans.append((start, end))
+
+def simple_sent_tokenize(text: str) -> List[str]:
+    '''
+    Pure-Python sentence splitter (no nltk needed).\n
+    Takes in text; returns sentences[].
+    '''
+    return [text[start:end] for (start, end) in simple_span_tokenize(text)]
+
+# Sentence tokenizer, loaded on first use (see get_span_tokenizer())
+span_tokenizer = None
+
+def get_span_tokenizer():
+    '''
+    Loads the sentence tokenizer the first time it's needed (nltk punkt from NLTK_DATA_DIR or nltk's usual paths, downloading it only if it's missing).\n
+    Falls back to simple_span_tokenize() if TOKENIZER is 'simple' or punkt can't be loaded. Returns a function: text -> spans[] ((start, end) of each sentence).
+    '''
+    global span_tokenizer
+    if span_tokenizer != None:
+        return span_tokenizer
+
+    if TOKENIZER == 'simple':
+        span_tokenizer = simple_span_tokenize
+        return span_tokenizer
+
+    import nltk
+    if NLTK_DATA_DIR not in nltk.data.path:
+        nltk.data.path.insert(0, NLTK_DATA_DIR)
+    try:
+        nltk.data.find('tokenizers/punkt')
+    except LookupError:
+        nltk.download('punkt', download_dir=NLTK_DATA_DIR, quiet=True)
+    try:
+        punkt = nltk.data.load('tokenizers/punkt/english.pickle')
+        span_tokenizer = lambda text: list(punkt.span_tokenize(text))
+    # If punkt couldn't be downloaded (e.g. offline), use the simple tokenizer
+    except LookupError:
+        span_tokenizer = simple_span_tokenize
+    return span_tokenizer
+
+def span_tokenize(text: str) -> List[Tuple[int, int]]:
+    '''
+    Finds the sentences in text.\n
+    Takes in text; returns spans[] ((start, end) character offsets of each sentence).
+    '''
+    return get_span_tokenizer()(text)
+
+def sent_tokenize(text: str) -> List[str]:
+    '''
+    Splits text into sentences.\n
+    Takes in text; returns sentences[].
+    '''
+    return [text[start:end] for (start, end) in span_tokenize(text)]
+
+class SentenceResult(NamedTuple):
+    '''
+    Result of checking a single sentence.\n
+    corrected == sentence if has_error is False. source is 'local' if the pre-screen decided it without a model call, otherwise 'model'.\n
+    start and end are the sentence's character offsets in the checked text (-1 if unknown).
+    '''
+    sentence: str
+    has_error: bool
+    corrected: str
+    source: str = 'model'
+    start: int = -1
+    end: int = -1
+
+class Exercise(NamedTuple):
+    '''
+    A practice exercise, generated along with everything needed to grade it.\n
+    correction == sentence if has_error is False. correction and explanation are '' if they couldn't be generated (grade with the model instead).
+    '''
+    sentence: str
+    has_error: bool
+    correction: str
+    concept: str
+    explanation: str
+
+async def loading_bar(window=None, key: str ='-ERR_MSG-'):
+    # Animates 'Loading...' in window[key] (the GUI is never imported here, so headless callers don't need it)
     if window == None:
         return
     while True:
@@ -20,44 +523,80 @@ async def loading_bar(window: sg.Window = None, key: str ='-ERR_MSG-'):
         window.Refresh()
         await asyncio.sleep(0.3)
 
-async def call_openai(model_name: str, init_prompt: str, prompt: str, temp=1, max_tok=200, window=None, key='-ERR_MSG-') -> Tuple[str, str]:
+async def call_openai(model_name: str, init_prompt: str, prompt: str, temp=1, max_tok=200, window=None, key='-ERR_MSG-', use_cache=True, on_token=None, coalesce=True, call_site='call_openai') -> Tuple[str, str]:
     '''
     Utility function to call ChatGPT/GPT4 while handling exceptions.\n
-    Takes in model_name, init_prompt, prompt, temp, max_tok, window, key; returns (out_msg, err_instr).
+    Takes in model_name, init_prompt, prompt, temp, max_tok, window, key, use_cache, on_token, coalesce, call_site (the function making the call, for tracing); returns (out_msg, err_instr).\n
+    If use_cache, identical calls are answered from (and successful responses are saved to) the response cache.\n
+    If on_token is given, the response is streamed and on_token(token) is called as each token arrives.\n
+    If coalesce (and not streaming), an identical call already in flight is waited on instead of sending another request (turn off when each call should get a fresh response).
     '''
     out_msg = ''
     err_instr = ''
+    counters = usage_counters.get()
+    usage = None
+    shared = False
+    span = tracer.start(call_site, 'call', model=model_name, call_site=call_site, lane=current_lane.get(), stream=on_token != None) if tracer != None else None
+
+    # If cached, skip the call entirely
+    use_cache = use_cache and cache != None
+    if use_cache:
+        cache_key = response_cache.make_key(model_name, init_prompt, prompt, temp, max_tok)
+        cached_msg = cache.get(cache_key)
+        if cached_msg != None:
+            if counters != None:
+                counters['cached'] += 1
+            if span != None:
+                tracer.finish(span, outcome='cached')
+            if on_token != None:
+                on_token(cached_msg)
+            return (cached_msg, err_instr)
+
+    # If no init_prompt:
+    if init_prompt == '':
+        m = [{"role": "user", "content": prompt}]
+    # If yes init_prompt:
+    else:
+        m = [{"role": "system", "content": init_prompt},{"role": "user", "content": prompt}]
+
+    loading_task = asyncio.create_task(loading_bar(window=window, key=key))
     try:
-        loading_task = asyncio.create_task(loading_bar(window=window, key=key))
-        # If no init_prompt:
-        if init_prompt == '':
-            m = [{"role": "user", "content": prompt}]
-            output = await openai.ChatCompletion.acreate(
-                        model = model_name,
-                        messages = [
-                            {"role": "user", "content": prompt}
-                        ],
-                        temperature = temp,
-                        max_tokens = max_tok,
-                        top_p = 0
-                    )
+        # If not streaming, wait for the whole response
+        if on_token == None:
+            if coalesce:
+                # Only share requests made with the same API key (so one user's bad key can't fail another's call)
+                flight_key = (response_cache.make_key(model_name, init_prompt, prompt, temp, max_tok), request_api_key.get())
+                (output, shared) = await send_shared(flight_key, model_name, m, temp, max_tok, call_site)
+            else:
+                output = await send_hedged(model_name, m, temp, max_tok, call_site)
             loading_task.cancel()
             out_msg = output['choices'][0]['message']['content']
-        # If yes init_prompt:
+            usage = output.get('usage')
+        # If streaming, pass on each token as soon as it arrives
         else:
-            m = [{"role": "system", "content": init_prompt},{"role": "user", "content": prompt}]
-            output = await openai.ChatCompletion.acreate(
-                        model = model_name,
-                        messages = [
-                            {"role": "system", "content": init_prompt},
-                            {"role": "user", "content": prompt}
-                        ],
-                        temperature = temp,
-                        max_tokens = max_tok,
-                        top_p = 0
-                    )
-            loading_task.cancel()
-            out_msg = output['choices'][0]['message']['content']
+            tokens = []
+            def add_token(token: str) -> None:
+                loading_task.cancel()
+                if span != None and not tokens:
+                    span.attrs['first_token'] = span.duration
+                tokens.append(token)
+                on_token(token)
+            (output, first_tokens) = await send_hedged(model_name, m, temp, max_tok, call_site, stream=True)
+            try:
+                for token in first_tokens:
+                    add_token(token)
+                async for chunk in output:
+                    token = chunk['choices'][0]['delta'].get('content', '')
+                    if token != '':
+                        add_token(token)
+            # Close the connection even if cancelled mid-stream
+            finally:
+                await output.aclose()
+            out_msg = ''.join(tokens)
+    except asyncio.CancelledError:
+        if span != None:
+            tracer.finish(span, outcome='cancelled')
+        raise
     except openai.error.Timeout as e:
         out_msg = ''
         err_instr = 'Request timed out. Please try again in a bit.'
@@ -75,7 +614,7 @@ async def call_openai(model_name: str, init_prompt: str, prompt: str, temp=1, ma
         err_instr = 'API key invalid or expired. Please enter a valid API key.'
     except openai.error.PermissionError as e:
         out_msg = ''
-        err_instr = 'Request not permitted. Please make sure your API key has permissions for gpt-3.5-turbo and gpt-4.'
+        err_instr = f'Request not permitted. Please make sure your API key has permissions for {model_name}.'
     except openai.error.RateLimitError as e:
         out_msg = ''
         err_instr = 'Request exceeded rate limit. Please wait a minute and try again.'
@@ -84,14 +623,72 @@ async def call_openai(model_name: str, init_prompt: str, prompt: str, temp=1, ma
         err_instr = 'There is a problem with OpenAI. Please try again in a bit.'
     except Exception as e:
         out_msg = ''
-        err_inistr = e
+        err_instr = str(e)
     finally:
+        loading_task.cancel()
         if window != None:
                 window[key].update('')
                 window.Refresh()
 
+    # Tokens used (estimated if the response didn't say; a shared request was already counted by the call that sent it)
+    prompt_tokens = 0
+    completion_tokens = 0
+    if not shared and err_instr == '':
+        if usage:
+            prompt_tokens = usage['prompt_tokens']
+            completion_tokens = usage['completion_tokens']
+        else:
+            prompt_tokens = sum(count_tokens(message['content']) for message in m)
+            completion_tokens = count_tokens(out_msg)
+
+    # Count the call
+    if counters != None and shared:
+        counters['deduped'] += 1
+    elif counters != None:
+        counters['calls'] += 1
+        if err_instr != '':
+            counters['failed'] += 1
+        counters['prompt_tokens'] += prompt_tokens
+        counters['completion_tokens'] += completion_tokens
+
+    # Record how the call went (time not spent queued went to the network and the model)
+    if span != None:
+        outcome = 'error' if err_instr != '' else 'deduped' if shared else 'ok'
+        tracer.finish(span, outcome=outcome, error=err_instr, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, cost=tracing.estimate_cost(model_name, prompt_tokens, completion_tokens))
+        span.attrs['service_time'] = span.duration - span.attrs.get('queue_wait', 0.0)
+
+    # Only successful responses are cached
+    if use_cache and err_instr == '' and out_msg != '':
+        cache.put(cache_key, out_msg)
+
     return (out_msg, err_instr)
 
+async def call_routed(call_type: str, init_prompt: str, prompt: str, validate=None, **kwargs) -> Tuple[str, str]:
+    '''
+    Calls the models routed to call_type in order (see ROUTES), only escalating to the next one if validate(out_msg) says the response isn't usable.\n
+    Takes in call_type, init_prompt, prompt, validate, kwargs (passed on to call_openai()); returns (out_msg, err_instr).\n
+    If every model's response fails validation, the last one is returned; if a call fails, its error is returned straight away (a stronger model won't fix a network or key problem).
+    '''
+    models = router.cascade(call_type) if router != None else ROUTES[call_type][-1:]
+    for (i, model_name) in enumerate(models):
+        (out_msg, err_instr) = await call_openai(model_name, init_prompt, prompt, call_site=call_type, **kwargs)
+        if err_instr != '':
+            decision = 'failed'
+        elif validate == None or validate(out_msg):
+            decision = 'accepted'
+        else:
+            decision = 'rejected'
+        if router != None:
+            router.record(call_type, model_name, decision)
+        if decision != 'rejected' or i == len(models) - 1:
+            return (out_msg, err_instr)
+
+def use_key(api_key: str) -> None:
+    '''
+    Makes every call use api_key without verifying it first (e.g. a saved key that was verified recently; see verify_key()).
+    '''
+    openai.api_key = api_key
+
 async def verify_key(api_key: str, window=None, key='-ERR_MSG-') -> Tuple[bool, str]:
     '''
     Verifies OpenAI API Key. If exception is thrown, returns error info and user instructions.\n
@@ -100,7 +697,7 @@ async def verify_key(api_key: str, window=None, key='-ERR_MSG-') -> Tuple[bool,
     is_valid_key = None
     openai.api_key = api_key
 
-    (out_msg, err_instr) = await call_openai('gpt-3.5-turbo', '', 'Hi', max_tok=1, window=window, key=key)
+    (out_msg, err_instr) = await call_routed('verify_key', '', 'Hi', max_tok=1, window=window, key=key, use_cache=False)
 
     # If no exceptions:
     if err_instr == '':
@@ -111,18 +708,18 @@ async def verify_key(api_key: str, window=None, key='-ERR_MSG-') -> Tuple[bool,
 
     return (is_valid_key, err_instr)
 
-async def is_correct(text: str, window=None, key='-ERR_MSG-') -> Tuple[bool, str]:
+async def is_correct(text: str, window=None, key='-ERR_MSG-', tokenize=True) -> Tuple[bool, str]:
     '''
     Checks if the text contains errors.\n
-    Takes in text, window, key; returns (is_correct, err_instr).
+    Takes in text, window, key, tokenize (False if text is already a single sentence); returns (is_correct, err_instr).
     '''
     is_correct = None
 
-    sentences = sent_tokenize(text)
+    sentences = sent_tokenize(text) if tokenize else [text]
     for sentence in sentences:
         is_correct_init_prompt = "You are a helpful AI assistant."
         is_correct_prompt = f"Is the following grammatically correct? Just tell me yes or no, nothing else.\n\n\"{sentence}\""
-        (out_msg, err_instr) = await call_openai('gpt-3.5-turbo', is_correct_init_prompt, is_correct_prompt, window=window, key=key)
+        (out_msg, err_instr) = await call_routed('is_correct', is_correct_init_prompt, is_correct_prompt, window=window, key=key)
 
         # If no exceptions:
         if err_instr == '':
@@ -136,91 +733,371 @@ async def is_correct(text: str, window=None, key='-ERR_MSG-') -> Tuple[bool, str
     
     return (is_correct, err_instr)
 
-async def correct(text: str, window=None, key='-ERR_MSG-') -> Tuple[str, str]:
+async def correct(text: str, window=None, key='-ERR_MSG-', on_token=None) -> Tuple[str, str]:
     '''
     Corrects text.\n
-    Takes in text, window, key; returns (corrected, err_instr).
+    Takes in text, window, key, on_token (to stream the correction); returns (corrected, err_instr).
     '''
     corrected = ''
     
     correct_prompt = f"Check the following for spelling and grammatical errors. Just return the corrected text, nothing else.\n\n\"{text}\""
-    (out_msg, err_instr) = await call_openai('gpt-3.5-turbo', '', correct_prompt, window=window, key=key)
+    (out_msg, err_instr) = await call_routed('correct', '', correct_prompt, window=window, key=key, on_token=on_token)
 
     corrected = out_msg.strip().strip('"')
     return (corrected, err_instr)
 
-async def explain_error(sent_A: str, sent_B: str, window=None, key='-ERR_MSG-') -> Tuple[str, str]:
+async def explain_error(sent_A: str, sent_B: str, window=None, key='-ERR_MSG-', on_token=None) -> Tuple[str, str]:
     '''
     Explains the grammatical error between sent_A (incorrect) and sent_B (correct).\n
-    Takes in sent_A, sent_B, window, key; returns (explanation, err_instr).
+    Takes in sent_A, sent_B, window, key, on_token (to stream the explanation); returns (explanation, err_instr).
     '''
     explanation = ''
 
     expl_error_init_prompt = "You are SmartTutor, an AI designed to help non-native English speakers improve their professional English. Please be comprehensive but concise in your answers."
     expl_error_prompt = f"Sentence B is the grammatically corrected version of sentence A. Given every difference, which sentence B corrects, comprehensively explain why sentence A needs to be changed, using understandable everyday language. Precede this with a short, easy to remember description of the errors, or error, followed by a newline break. Keep the explanation under or as close to 20 words as possible per error.\n\nA: {sent_A}\nB: {sent_B}"
     
-    (out_msg, err_instr) = await call_openai('gpt-3.5-turbo', expl_error_init_prompt, expl_error_prompt, window=window, key=key)
+    (out_msg, err_instr) = await call_routed('explain_error', expl_error_init_prompt, expl_error_prompt, window=window, key=key, on_token=on_token)
 
     explanation = out_msg
     return (explanation, err_instr)
 
-async def gen_incorrect(sent_A: str, window=None, key='-ERR_MSG-') -> Tuple[str, str]:
+async def gen_incorrect(sent_A: str, window=None, key='-ERR_MSG-', use_cache=False) -> Tuple[str, str]:
     '''
     Generates a sentece with the same grammatical error as sent_A.\n
-    Takes in sent_A, window, key; returns (sent_B, err_instr).
+    Takes in sent_A, window, key, use_cache; returns (sent_B, err_instr).
     '''
     sent_B = ''
 
     gram_error_code_init_prompt = "You are a helpful AI assistant."
     gram_error_code_prompt = f"Give me a short, easy to remember description of the grammatical concept in the following sentence misuses. Just give me the concept. Nothing else.\n\n{sent_A}"
-    (gram_error_code, err_instr) = await call_openai('gpt-3.5-turbo', gram_error_code_init_prompt, gram_error_code_prompt, window=window, key=key)
+    (gram_error_code, err_instr) = await call_routed('gen_incorrect.concept', gram_error_code_init_prompt, gram_error_code_prompt, window=window, key=key)
 
     gram_error_code = gram_error_code.strip().strip('"').strip('.')
 
     gen_incorrect_prompt = f"Generate a sentence with the following error: {gram_error_code}, the same grammatical error as sentence A\n\nA: Your child were at school today\nB: She were eating dinner\n\nA: The dogs were eat at the park\nB: The children were sit at the table\n\nA: We need to get our sale's numbers up\nB: There are many desk's in this room\n\nA: {sent_A}\nB:"
-    (out_msg, err_instr) = await call_openai('gpt-4', '', gen_incorrect_prompt, window=window, key=key)
+    (out_msg, err_instr) = await call_routed('gen_incorrect', '', gen_incorrect_prompt, validate=lambda out_msg: valid_generated_sentence(out_msg, sent_A), window=window, key=key, use_cache=use_cache, coalesce=use_cache)
 
     sent_B = out_msg.strip().strip('"')
     return (sent_B, err_instr)
 
-async def gen_correct(sent_A: str, window=None, key='-ERR_MSG-') -> Tuple[str, str]:
+async def gen_correct(sent_A: str, window=None, key='-ERR_MSG-', use_cache=False) -> Tuple[str, str]:
     '''
     Generates a grammatically corrrect sentence with the same grammar concept that sent_A got wrong.\n
-    Takes in sent_A, window, key; returns (sent_B, err_instr).
+    Takes in sent_A, window, key, use_cache; returns (sent_B, err_instr).
     '''
     sent_B = ''
 
     gen_correct_init_prompt = "You are a helpful AI assistant."
     gen_correct_prompt = f"Generate a grammatically correct sentence using the grammar concept that the following sentence uses incorrectly, but change the subject. Just give me the sentence, nothing else.\n\n\"{sent_A}\""
-    (out_msg, err_instr) = await call_openai('gpt-4', gen_correct_init_prompt, gen_correct_prompt, window=window, key=key)
+    (out_msg, err_instr) = await call_routed('gen_correct', gen_correct_init_prompt, gen_correct_prompt, validate=lambda out_msg: valid_generated_sentence(out_msg, sent_A), window=window, key=key, use_cache=use_cache, coalesce=use_cache)
 
     sent_B = out_msg.strip().strip('"')
     return (sent_B, err_instr)
 
-async def check(text: str, window=None, key='-ERR_MSG-') -> Tuple[List[str], List[str], str]:
+async def gen_exercise_bundle(sent_A: str, has_error: bool, window=None, key='-ERR_MSG-', use_cache=False) -> Tuple[Optional[Exercise], str]:
     '''
-    Checks text for grammatical errors.\n
-    Takes in text, window, key; returns (errors[], corrected[], err_instr).
+    Generates a practice exercise based on the grammatical error in sent_A (one with the same error if has_error, otherwise one using the same concept correctly), along with its correction, concept and explanation, in one call.\n
+    Takes in sent_A, has_error, window, key, use_cache; returns (exercise, err_instr).\n
+    Falls back to gen_incorrect()/gen_correct() (without a correction or explanation) if the response is malformed.
     '''
-    errors = []
-    corrected = []
-    err_instr = ''
+    exercise = None
 
-    sentences = sent_tokenize(text)
-    for sentence in sentences:
-        # Check if the text even contains grammatical errors
-        (no_errors, err_instr) = await is_correct(sentence, window=window, key=key)
+    if has_error:
+        task = "Write a new sentence B, with a different subject, that makes the same grammatical error as sentence A."
+    else:
+        task = "Write a new sentence B, with a different subject, that correctly uses the grammar concept sentence A gets wrong."
+    bundle_init_prompt = "You are SmartTutor, an AI designed to help non-native English speakers improve their professional English. Please be comprehensive but concise in your answers."
+    bundle_prompt = f"Create a grammar practice exercise based on sentence A. {task} Just return a JSON object with these keys, nothing else: \"sentence\" (sentence B), \"correction\" (sentence B with its error fixed, or sentence B itself if it has no error), \"concept\" (a short, easy to remember description of the grammar concept), \"explanation\" (why the correction is right, using understandable everyday language, in 20 words or less).\n\nA: {sent_A}"
+    (out_msg, err_instr) = await call_routed('gen_exercise_bundle', bundle_init_prompt, bundle_prompt, validate=lambda out_msg: valid_exercise(parse_exercise_response(out_msg, has_error), sent_A), max_tok=300, window=window, key=key, use_cache=use_cache, coalesce=use_cache)
+
+    # If error, return
+    if err_instr != '':
+        return (exercise, err_instr)
+
+    exercise = parse_exercise_response(out_msg, has_error)
+    # If malformed, generate just the sentence the old way
+    if exercise == None:
+        (sentence, err_instr) = await (gen_incorrect(sent_A, window=window, key=key, use_cache=use_cache) if has_error else gen_correct(sent_A, window=window, key=key, use_cache=use_cache))
+        exercise = Exercise(sentence, has_error, '', '', '')
+    return (exercise, err_instr)
+
+def parse_exercise_response(out_msg: str, has_error: bool) -> Optional[Exercise]:
+    '''
+    Parses the JSON object returned by gen_exercise_bundle().\n
+    Takes in out_msg, has_error; returns the exercise, or None if out_msg is malformed.
+    '''
+    # Ignore anything around the object (e.g. ```json fences)
+    start = out_msg.find('{')
+    end = out_msg.rfind('}')
+    if start == -1 or end < start:
+        return None
+    try:
+        bundle = json.loads(out_msg[start:end+1])
+    except ValueError:
+        return None
+    if not isinstance(bundle, dict):
+        return None
+    fields = []
+    for field in ('sentence', 'correction', 'concept', 'explanation'):
+        value = bundle.get(field)
+        if not isinstance(value, str) or value.strip() == '':
+            return None
+        fields.append(value.strip().strip('"') if field in ('sentence', 'correction') else value.strip())
+    (sentence, correction, concept, explanation) = fields
+    # A sentence with an error has to have a correction that changes it; a correct one is its own correction
+    if has_error and correction == sentence:
+        return None
+    if not has_error:
+        correction = sentence
+    return Exercise(sentence, has_error, correction, concept, explanation)
+
+def valid_generated_sentence(out_msg: str, sent_A: str) -> bool:
+    # A generated practice sentence has to be a single, non-empty sentence that isn't just sent_A again
+    sentence = out_msg.strip().strip('"')
+    return sentence != '' and '\n' not in sentence and len(sent_tokenize(sentence)) == 1 and normalize_sentence(sentence) != normalize_sentence(sent_A)
+
+def valid_exercise(exercise: Optional[Exercise], sent_A: str) -> bool:
+    # A generated exercise has to parse, have a valid sentence, and (only if it has an error) a correction that actually changes its words
+    if exercise == None or not valid_generated_sentence(exercise.sentence, sent_A):
+        return False
+    return (normalize_sentence(exercise.correction) != normalize_sentence(exercise.sentence)) == exercise.has_error
+
+def normalize_sentence(text: str) -> List[str]:
+    # Ignore case, spacing and punctuation (apart from apostrophes within words) when comparing sentences; returns the words
+    text = re.sub(r"[^\w\s']", ' ', text.lower())
+    text = re.sub(r"(?<!\w)'|'(?!\w)", ' ', text)
+    return text.split()
+
+def grade_answer(answer: str, exercise: Exercise) -> Optional[bool]:
+    '''
+    Grades the user's correction of an exercise locally, against its generated correction (no model calls).\n
+    Takes in answer, exercise; returns True if it has the same words as the correction, False if it leaves the sentence as is, or None if it can't tell (ask the model).\n
+    Anything else goes to the model: in a grammar exercise, a one-letter difference from the correction is usually a new error.
+    '''
+    answer_words = normalize_sentence(answer)
+    reference_words = normalize_sentence(exercise.correction)
+    sentence_words = normalize_sentence(exercise.sentence)
+    # If the fix is only case or punctuation, leaving the sentence as is and fixing it look the same here
+    if reference_words == sentence_words:
+        return None
+    if answer_words == reference_words:
+        return True
+    if answer_words == sentence_words:
+        return False
+    return None
+
+async def check_sentence(sentence: str, semaphore: asyncio.Semaphore) -> Tuple[Optional[SentenceResult], str]:
+    '''
+    Checks (and, if needed, corrects) a single sentence, waiting on semaphore before calling OpenAI.\n
+    Takes in sentence, semaphore; returns (result, err_instr). result is None if an exception was thrown.
+    '''
+    async with semaphore:
+        # Check if the sentence even contains grammatical errors
+        (no_errors, err_instr) = await is_correct(sentence, tokenize=False)
         if err_instr != '':
-            return (errors, corrected, err_instr)
-        # If there is an error, append it to errors[]; if no errors, don't bother to correct
-        if not no_errors:
-            errors.append(sentence)
-        else:
-            continue
+            return (None, err_instr)
+        # If no errors, don't bother to correct
+        if no_errors:
+            return (SentenceResult(sentence, False, sentence), err_instr)
         # If there are grammatical errors, call ChatGPT to correct them
-        (corrected_sent, err_instr) = await correct(sentence, window=window, key=key)
+        (corrected_sent, err_instr) = await correct(sentence)
         if err_instr != '':
-            return (errors, corrected, err_instr)
-        corrected.append(corrected_sent)
+            return (None, err_instr)
+        return (SentenceResult(sentence, True, corrected_sent), err_instr)
+
+def parse_batch_response(out_msg: str, sentences: List[str]) -> Optional[List[SentenceResult]]:
+    '''
+    Parses the JSON list returned by a batched check.\n
+    Takes in out_msg, sentences[]; returns results[] (in the same order as sentences[]), or None if out_msg is malformed.
+    '''
+    # Ignore anything around the list (e.g. ```json fences or a leading sentence)
+    start = out_msg.find('[')
+    end = out_msg.rfind(']')
+    if start == -1 or end < start:
+        return None
+    try:
+        verdicts = json.loads(out_msg[start:end+1])
+    except ValueError:
+        return None
+    if not isinstance(verdicts, list) or len(verdicts) != len(sentences):
+        return None
+
+    results = [None] * len(sentences)
+    for verdict in verdicts:
+        if not isinstance(verdict, dict):
+            return None
+        # Ids are 1-indexed; every sentence must get exactly one verdict
+        try:
+            idx = int(verdict.get('id')) - 1
+        except (TypeError, ValueError):
+            return None
+        if idx < 0 or idx >= len(sentences) or results[idx] != None:
+            return None
+        no_errors = verdict.get('correct')
+        # Only real booleans or yes/no strings count as a verdict
+        if isinstance(no_errors, str):
+            no_errors = {'true': True, 'yes': True, 'y': True, 'false': False, 'no': False, 'n': False}.get(no_errors.strip().lower())
+        if not isinstance(no_errors, bool):
+            return None
+        corrected_sent = verdict.get('corrected', '')
+        if not isinstance(corrected_sent, str):
+            return None
+        corrected_sent = corrected_sent.strip().strip('"')
+        # If incorrect, there has to be a correction that actually changes something; if correct, it can't come with a different sentence (otherwise the verdict can't be trusted)
+        if not no_errors and corrected_sent in ('', sentences[idx]):
+            return None
+        if no_errors and corrected_sent != '' and normalize_sentence(corrected_sent) != normalize_sentence(sentences[idx]):
+            return None
+        if no_errors:
+            results[idx] = SentenceResult(sentences[idx], False, sentences[idx])
+        else:
+            results[idx] = SentenceResult(sentences[idx], True, corrected_sent)
+
+    return results
+
+async def check_batch(sentences: List[str], semaphore: asyncio.Semaphore) -> List[Tuple[Optional[SentenceResult], str]]:
+    '''
+    Checks and corrects several sentences with a single call, falling back to check_sentence() for each one if the response is malformed.\n
+    Takes in sentences[], semaphore; returns [(result, err_instr), ...] in the same order as sentences[].
+    '''
+    check_batch_init_prompt = "You are a helpful AI assistant."
+    check_batch_prompt = "Check each of the following numbered sentences for spelling and grammatical errors. Reply with only a JSON list containing one object per sentence, in order, like this: [{\"id\": 1, \"correct\": true, \"corrected\": \"<the corrected sentence, or the original if it is correct>\"}]. Nothing else.\n\n"
+    check_batch_prompt += '\n'.join(f'{i+1}. "{sentence}"' for (i, sentence) in enumerate(sentences))
+    # Roughly enough room to repeat every sentence back, plus the JSON around it
+    max_tok = sum(len(sentence) // 3 + 30 for sentence in sentences)
+
+    async with semaphore:
+        (out_msg, err_instr) = await call_routed('check_batch', check_batch_init_prompt, check_batch_prompt, max_tok=max_tok)
+    if err_instr != '':
+        return [(None, err_instr)] * len(sentences)
+
+    results = parse_batch_response(out_msg, sentences)
+    # If malformed, check each sentence separately
+    if results == None:
+        return await asyncio.gather(*[check_sentence(sentence, semaphore) for sentence in sentences])
+    return [(result, '') for result in results]
+
+async def check_sentences(sentences: List[str], max_concurrency=MAX_CONCURRENCY, batch_size=BATCH_SIZE, window=None, key='-ERR_MSG-', on_result=None) -> Tuple[List[Optional[SentenceResult]], str]:
+    '''
+    Checks already-split sentences concurrently (at most max_concurrency calls at a time), batch_size sentences per call.\n
+    Takes in sentences[], max_concurrency, batch_size, window, key, on_result; returns (results[], err_instr).\n
+    results[] is in the same order as sentences[]; sentences that failed are None (partial results), and err_instr is the first error hit.\n
+    Sentences the pre-screen (screener) is confident are correct are decided locally, without a call.\n
+    If on_result is given, on_result(result) is called for each sentence as soon as its call finishes (a batch is one JSON reply, so its sentences arrive together).
+    '''
+    results = []
+    err_instr = ''
+
+    # Only sentences the pre-screen can't vouch for go to the model
+    passed = [screener != None and screener.screen(sentence) for sentence in sentences]
+    counters = usage_counters.get()
+    if counters != None:
+        counters['screened'] += sum(passed)
+    all_sentences = sentences
+    sentences = [sentence for (sentence, is_passed) in zip(all_sentences, passed) if not is_passed]
+
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def reported(coro):
+        # Passes each finished sentence to on_result before the rest of the check is done
+        outcome = await coro
+        if on_result != None:
+            for (result, sent_err_instr) in (outcome if isinstance(outcome, list) else [outcome]):
+                if result != None:
+                    on_result(result)
+        return outcome
+
+    # One loading bar for the whole check (instead of one per call)
+    loading_task = asyncio.create_task(loading_bar(window=window, key=key))
+    try:
+        # Batched mode: one call per batch_size sentences
+        if batch_size > 1:
+            batches = [sentences[i:i+batch_size] for i in range(0, len(sentences), batch_size)]
+            batch_outcomes = await asyncio.gather(*[reported(check_batch(batch, semaphore)) for batch in batches], return_exceptions=True)
+            outcomes = []
+            for (batch, batch_outcome) in zip(batches, batch_outcomes):
+                if isinstance(batch_outcome, Exception):
+                    outcomes.extend([batch_outcome] * len(batch))
+                else:
+                    outcomes.extend(batch_outcome)
+        # Per-sentence mode: is_correct (+ correct) for each sentence
+        else:
+            outcomes = await asyncio.gather(*[reported(check_sentence(sentence, semaphore)) for sentence in sentences], return_exceptions=True)
+    finally:
+        loading_task.cancel()
+        if window != None:
+            window[key].update('')
+            window.Refresh()
+
+    for outcome in outcomes:
+        # If unexpected exception, mark sentence as unchecked
+        if isinstance(outcome, Exception):
+            results.append(None)
+            if err_instr == '':
+                err_instr = 'An error has occurred. Please try again.'
+            continue
+        (result, sent_err_instr) = outcome
+        results.append(result)
+        if sent_err_instr != '' and err_instr == '':
+            err_instr = sent_err_instr
+
+    # Remember only what the model itself said was correct, so the pre-screen can pass it (and sentences like it) next time
+    if screener != None:
+        screener.confirm([result.sentence for result in results if result != None and result.source == 'model' and not result.has_error])
+
+    # Put the locally decided sentences back in order
+    model_results = iter(results)
+    results = [SentenceResult(sentence, False, sentence, 'local') if is_passed else next(model_results) for (sentence, is_passed) in zip(all_sentences, passed)]
+
+    return (results, err_instr)
+
+async def check(text: str, window=None, key='-ERR_MSG-', max_concurrency=MAX_CONCURRENCY, batch_size=BATCH_SIZE) -> Tuple[List[str], List[str], str]:
+    '''
+    Checks text for grammatical errors, making up to max_concurrency calls at the same time with batch_size sentences per call.\n
+    Takes in text, window, key, max_concurrency, batch_size; returns (errors[], corrected[], err_instr).\n
+    If some sentences fail, errors[] and corrected[] still hold the results (in order) of the sentences that didn't.
+    '''
+    errors = []
+    corrected = []
+
+    sentences = sent_tokenize(text)
+    (results, err_instr) = await check_sentences(sentences, max_concurrency=max_concurrency, batch_size=batch_size, window=window, key=key)
+    for result in results:
+        # If there is an error, append it to errors[] and its correction to corrected[]
+        if result != None and result.has_error:
+            errors.append(result.sentence)
+            corrected.append(result.corrected)
 
     return (errors, corrected, err_instr)
+
+async def recheck(text: str, prev_results: List[Optional[SentenceResult]], window=None, key='-ERR_MSG-', max_concurrency=MAX_CONCURRENCY, batch_size=BATCH_SIZE, on_result=None) -> Tuple[List[Optional[SentenceResult]], str]:
+    '''
+    Re-checks text after an edit, only sending sentences that were added or changed since prev_results[] (the results of the last check).\n
+    Takes in text, prev_results[], window, key, max_concurrency, batch_size, on_result (see check_sentences(); only called for the added/changed sentences); returns (results[], err_instr).\n
+    results[] is in the same order as the sentences of text, each with its offsets in text (start, end); sentences that failed are None.
+    '''
+    spans = span_tokenize(text)
+    sentences = [text[start:end] for (start, end) in spans]
+    results = [None] * len(sentences)
+
+    # Diff the new sentences against the old ones (sentences that failed last time never match, so they get checked again)
+    prev_sentences = [result.sentence if result != None else None for result in prev_results]
+    matcher = difflib.SequenceMatcher(None, prev_sentences, sentences, autojunk=False)
+    for (tag, prev_start, prev_end, start, end) in matcher.get_opcodes():
+        if tag == 'equal':
+            results[start:end] = prev_results[prev_start:prev_end]
+
+    # Only check added/changed sentences
+    changed_idxs = [i for i in range(0, len(sentences)) if results[i] == None]
+    err_instr = ''
+    if changed_idxs:
+        (changed_results, err_instr) = await check_sentences([sentences[i] for i in changed_idxs], max_concurrency=max_concurrency, batch_size=batch_size, window=window, key=key, on_result=on_result)
+        for (i, result) in zip(changed_idxs, changed_results):
+            results[i] = result
+
+    # Record where each sentence is in text (unchanged sentences may have moved)
+    for i in range(0, len(results)):
+        if results[i] != None:
+            results[i] = results[i]._replace(start=spans[i][0], end=spans[i][1])
+
+    return (results, err_instr)
@@ -0,0 +1,56 @@
+from typing import Optional, List
+
+# Percentile of recent latency (per model and call type) after which a duplicate request is sent
+HEDGE_PERCENTILE = 95
+# Latency measurements needed before a model / call type is hedged
+MIN_SAMPLES = 20
+# Max fraction of hedgeable requests that may actually be hedged (each hedge costs a second request)
+MAX_HEDGE_RATE = 0.1
+# Seconds to wait before hedging, at the least
+MIN_DELAY = 0.1
+
+class Hedger:
+    '''
+    Decides when a slow request gets a duplicate ("hedge"): once it has taken longer than the percentile-th percentile of recent latency for its model and call type.\n
+    Only call types in call_types are hedged, and at most max_rate of them; counts hedges fired and won (the duplicate finished first).
+    '''
+
+    def __init__(self, call_types: List[str], percentile=HEDGE_PERCENTILE, min_samples=MIN_SAMPLES, max_rate=MAX_HEDGE_RATE, min_delay=MIN_DELAY):
+        self.call_types = set(call_types)
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.max_rate = max_rate
+        self.min_delay = min_delay
+        self.eligible = 0
+        self.fired = 0
+        self.won = 0
+        self.capped = 0
+
+    def delay(self, call_type: str, latency: Optional[float]) -> Optional[float]:
+        '''
+        Takes in call_type, latency (the learned percentile for the request's model and call type, None if not known yet); returns how many seconds to wait before hedging, or None to never hedge this request.
+        '''
+        if call_type not in self.call_types or latency == None:
+            return None
+        self.eligible += 1
+        return max(self.min_delay, latency)
+
+    def fire(self) -> bool:
+        '''
+        Returns whether a hedge may be sent now (and counts it), keeping hedges under max_rate of eligible requests.
+        '''
+        if self.fired + 1 > self.max_rate * self.eligible:
+            self.capped += 1
+            return False
+        self.fired += 1
+        return True
+
+    def stats(self) -> dict:
+        return {
+            'eligible': self.eligible,
+            'fired': self.fired,
+            'won': self.won,
+            'capped': self.capped,
+            'hedge_rate': self.fired / self.eligible if self.eligible else 0.0,
+            'win_rate': self.won / self.fired if self.fired else 0.0
+        }
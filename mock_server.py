@@ -0,0 +1,261 @@
+'''
+Local stand-in for the OpenAI chat completions API, for load testing and benchmarking without a network or API costs.\n
+Serves POST /v1/chat/completions (streamed or not) with canned grammar responses, configurable latency and injected errors.\n
+Run it, then point LexEd at it:\n
+    $ python mock_server.py --port 8808 --latency gpt-4=lognormal:1.5,0.4 --error rate_limit=0.05\n
+    $ LEXED_API_BASE=http://127.0.0.1:8808/v1 python display.py
+'''
+
+import asyncio
+import argparse
+import json
+import random
+import re
+import time
+from typing import List, Callable
+from aiohttp import web
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8808
+# Seconds an injected 'timeout' error stalls for (longer than any client timeout)
+TIMEOUT_STALL = 3600
+
+# Injected errors (and the exception call_openai() gets for each): status code, OpenAI error type
+ERRORS = {
+    'timeout': None,            # openai.error.Timeout (never responds)
+    'api': (500, 'server_error'),                   # openai.error.APIError
+    'connection': None,         # openai.error.APIConnectionError (drops the connection)
+    'invalid': (400, 'invalid_request_error'),      # openai.error.InvalidRequestError
+    'auth': (401, 'invalid_api_key'),               # openai.error.AuthenticationError
+    'permission': (403, 'permission_error'),        # openai.error.PermissionError
+    'rate_limit': (429, 'rate_limit_exceeded'),     # openai.error.RateLimitError
+    'unavailable': (503, 'server_error')            # openai.error.ServiceUnavailableError
+}
+
+# Common errors the canned grammar checker knows how to fix (pattern, fix)
+FIXES = [
+    (r'\b(he|she|it|this|that) are\b', r'\1 is'),
+    (r'\b(he|she|it|this|that) were\b', r'\1 was'),
+    (r'\b(he|she|it) have\b', r'\1 has'),
+    (r'\b(he|she|it) do\b', r'\1 does'),
+    (r'\b(I|you|we|they) is\b', r'\1 are'),
+    (r'\b(I|you|we|they) was\b', r'\1 were'),
+    (r'\b(I|you|we|they) has\b', r'\1 have'),
+    (r'\b(I|you|we|they) does\b', r'\1 do'),
+    (r'\bI are\b', 'I am'),
+    (r'\ba ([aeiou])', r'an \1'),
+    (r'\b(\w+) \1\b', r'\1'),
+    (r"\b(\w+)'s (numbers|desks|sales)\b", r'\1 \2')
+]
+
+INCORRECT_SENTS = ['She were eating dinner.', 'The children is at the table.', 'He have a meeting at noon.', 'They was late to the office.', 'We needs to finish the report.']
+CORRECT_SENTS = ['She was eating dinner.', 'The children are at the table.', 'He has a meeting at noon.', 'They were late to the office.', 'We need to finish the report.']
+
+def fix_sentence(sentence: str) -> str:
+    '''
+    Canned grammar checker.\n
+    Takes in sentence; returns the corrected sentence (== sentence if nothing was wrong).
+    '''
+    for (pattern, fix) in FIXES:
+        sentence = re.sub(pattern, fix, sentence, flags=re.IGNORECASE)
+    return sentence
+
+def canned_response(prompt: str) -> str:
+    '''
+    Picks a believable response for each of the prompts gpt_tester sends.\n
+    Takes in prompt (the last message); returns the response text.
+    '''
+    quoted = re.findall(r'"(.*)"', prompt)
+    # is_correct()
+    if prompt.startswith('Is the following grammatically correct?'):
+        return 'Yes' if fix_sentence(quoted[-1]) == quoted[-1] else 'No'
+    # check_batch()
+    if prompt.startswith('Check each of the following numbered sentences'):
+        sentences = re.findall(r'^\d+\. "(.*)"$', prompt, flags=re.MULTILINE)
+        return json.dumps([{'id': i+1, 'correct': fix_sentence(sentence) == sentence, 'corrected': fix_sentence(sentence)} for (i, sentence) in enumerate(sentences)])
+    # correct()
+    if prompt.startswith('Check the following for spelling and grammatical errors'):
+        return f'"{fix_sentence(quoted[-1])}"'
+    # explain_error()
+    if prompt.startswith('Sentence B is the grammatically corrected version'):
+        return 'Subject-verb agreement\nThe verb has to match its subject: singular subjects take singular verbs, plural subjects take plural verbs.'
+    # gen_incorrect() (concept, then sentence)
+    if prompt.startswith('Give me a short, easy to remember description'):
+        return 'Subject-verb agreement'
+    if prompt.startswith('Generate a sentence with the following error'):
+        return random.choice(INCORRECT_SENTS)
+    # gen_exercise_bundle()
+    if prompt.startswith('Create a grammar practice exercise'):
+        i = random.randrange(len(INCORRECT_SENTS))
+        sentence = INCORRECT_SENTS[i] if 'same grammatical error' in prompt else CORRECT_SENTS[i]
+        return json.dumps({'sentence': sentence, 'correction': CORRECT_SENTS[i], 'concept': 'Subject-verb agreement', 'explanation': 'The verb has to match its subject: singular subjects take singular verbs.'})
+    # gen_correct()
+    if prompt.startswith('Generate a grammatically correct sentence'):
+        return random.choice(CORRECT_SENTS)
+    # verify_key() and anything else
+    return 'Hello'
+
+def parse_latency(spec: str) -> Callable[[], float]:
+    '''
+    Parses a latency distribution: constant:S, uniform:LOW,HIGH, normal:MEAN,STDEV, lognormal:MEDIAN,SIGMA or exponential:MEAN (all in seconds).\n
+    Takes in spec; returns a function that samples a latency.
+    '''
+    (kind, _, params) = spec.partition(':')
+    args = [float(param) for param in params.split(',') if param != '']
+    if kind == 'constant':
+        return lambda: args[0]
+    if kind == 'uniform':
+        return lambda: random.uniform(args[0], args[1])
+    if kind == 'normal':
+        return lambda: max(0.0, random.gauss(args[0], args[1]))
+    if kind == 'lognormal':
+        return lambda: args[0] * random.lognormvariate(0, args[1])
+    if kind == 'exponential':
+        return lambda: random.expovariate(1 / args[0])
+    raise ValueError(f'Unknown latency distribution: {spec}')
+
+class MockConfig:
+    '''
+    Latency (per model), token streaming speed and error injection rates for the mock server.
+    '''
+
+    def __init__(self, latency=None, default_latency='constant:0', token_delay=0.0, error_rates=None, seed=None):
+        self.latency = {model: parse_latency(spec) for (model, spec) in (latency or {}).items()}
+        self.default_latency = parse_latency(default_latency)
+        self.token_delay = token_delay
+        self.error_rates = error_rates or {}
+        self.requests = 0
+        self.errors = {kind: 0 for kind in ERRORS}
+        if seed != None:
+            random.seed(seed)
+
+    def sample_latency(self, model_name: str) -> float:
+        return self.latency.get(model_name, self.default_latency)()
+
+    def sample_error(self) -> str:
+        '''
+        Returns the kind of error to inject into this request ('' for none).
+        '''
+        roll = random.random()
+        for (kind, rate) in self.error_rates.items():
+            if roll < rate:
+                return kind
+            roll -= rate
+        return ''
+
+def count_tokens(text: str) -> int:
+    # Roughly 4 characters per token
+    return max(1, len(text) // 4)
+
+async def chat_completions(request: web.Request) -> web.StreamResponse:
+    config = request.app['config']
+    config.requests += 1
+    body = await request.json()
+    model_name = body.get('model', '')
+    messages = body.get('messages', [])
+
+    await asyncio.sleep(config.sample_latency(model_name))
+
+    # Inject an error
+    error = config.sample_error()
+    if error != '':
+        config.errors[error] += 1
+        if error == 'timeout':
+            # Stall until the client gives up (or the server shuts down)
+            try:
+                await asyncio.wait_for(request.app['stopping'].wait(), TIMEOUT_STALL)
+            except asyncio.TimeoutError:
+                pass
+            return web.Response(status=504)
+        if error == 'connection':
+            request.transport.close()
+            return web.Response()
+        (status, error_type) = ERRORS[error]
+        return web.json_response({'error': {'message': f'Injected {error} error', 'type': error_type, 'param': None, 'code': error_type}}, status=status)
+
+    content = canned_response(messages[-1]['content'] if messages else '')
+    # Respect max_tokens (roughly)
+    max_tok = body.get('max_tokens') or 200
+    content = content[:max_tok*4]
+    prompt_tokens = sum(count_tokens(message.get('content', '')) for message in messages)
+    completion_tokens = count_tokens(content)
+    response_id = f'chatcmpl-mock{config.requests}'
+
+    # If not streaming, send the whole response
+    if not body.get('stream'):
+        return web.json_response({
+            'id': response_id,
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': model_name,
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens, 'total_tokens': prompt_tokens + completion_tokens}
+        })
+
+    # If streaming, send server-sent events (one per word)
+    response = web.StreamResponse(headers={'Content-Type': 'text/event-stream'})
+    await response.prepare(request)
+    for token in re.findall(r'\S+\s*', content):
+        chunk = {'id': response_id, 'object': 'chat.completion.chunk', 'created': int(time.time()), 'model': model_name, 'choices': [{'index': 0, 'delta': {'content': token}, 'finish_reason': None}]}
+        await response.write(f'data: {json.dumps(chunk)}\n\n'.encode())
+        await asyncio.sleep(config.token_delay)
+    await response.write(b'data: [DONE]\n\n')
+    await response.write_eof()
+    return response
+
+async def on_shutdown(app: web.Application) -> None:
+    # Release stalled requests so shutdown doesn't wait on them
+    app['stopping'].set()
+
+def build_app(config: MockConfig) -> web.Application:
+    app = web.Application()
+    app['config'] = config
+    app['stopping'] = asyncio.Event()
+    app.on_shutdown.append(on_shutdown)
+    app.router.add_post('/v1/chat/completions', chat_completions)
+    app.router.add_post('/chat/completions', chat_completions)
+    return app
+
+async def start_mock_server(config: MockConfig, host=DEFAULT_HOST, port=DEFAULT_PORT) -> web.AppRunner:
+    '''
+    Starts the mock server in the current event loop.\n
+    Takes in config, host, port; returns the runner (await runner.cleanup() to stop it).
+    '''
+    runner = web.AppRunner(build_app(config))
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+def parse_pairs(pairs: List[str]) -> dict:
+    # ['a=b', ...] -> {'a': 'b', ...}
+    return dict(pair.split('=', 1) for pair in pairs)
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Local stand-in for the OpenAI chat completions API.')
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--latency', action='append', default=[], metavar='MODEL=DIST', help='latency distribution for a model, e.g. gpt-4=lognormal:1.5,0.4')
+    parser.add_argument('--default-latency', default='constant:0', metavar='DIST', help='latency distribution for every other model')
+    parser.add_argument('--token-delay', type=float, default=0.0, help='seconds between streamed tokens')
+    parser.add_argument('--error', action='append', default=[], metavar='KIND=RATE', help=f'fraction of requests failing with KIND ({", ".join(ERRORS)})')
+    parser.add_argument('--seed', type=int, default=None)
+    return parser.parse_args(argv)
+
+async def main(args: argparse.Namespace) -> None:
+    error_rates = {kind: float(rate) for (kind, rate) in parse_pairs(args.error).items()}
+    for kind in error_rates:
+        if kind not in ERRORS:
+            raise ValueError(f'Unknown error kind: {kind}')
+    config = MockConfig(latency=parse_pairs(args.latency), default_latency=args.default_latency, token_delay=args.token_delay, error_rates=error_rates, seed=args.seed)
+    runner = await start_mock_server(config, args.host, args.port)
+    print(f'Mock OpenAI server listening on http://{args.host}:{args.port}/v1')
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(main(parse_args()))
+    except KeyboardInterrupt:
+        pass
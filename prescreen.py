@@ -0,0 +1,176 @@
+import sqlite3
+import hashlib
+import re
+import time
+from typing import List
+
+# Default location of the pre-screen data (next to 'credentials.json')
+PRESCREEN_PATH = 'prescreen.sqlite3'
+# Fraction (0-1) of a sentence's word pairs that must have been seen in confirmed-correct sentences for it to skip the model (when scoring is on)
+# Anything under 1 lets a dropped or changed word through: that's a single unseen pair
+THRESHOLD = 1.0
+# Sentences shorter than this (in words) are always sent to the model, unless they were confirmed correct before
+MIN_WORDS = 4
+# Max number of confirmed sentences kept before the oldest ones are forgotten
+MAX_ENTRIES = 50000
+# Seconds a confirmed sentence is trusted for (30 days); after that it goes to the model again
+TTL = 30 * 24 * 60 * 60
+
+# Common errors: a sentence matching any of these always goes to the model
+ERROR_PATTERNS = [re.compile(pattern, re.IGNORECASE) for pattern in [
+    r'\b(he|she|it|this|that) (are|were|have|do|don\'t)\b',
+    r'\b(i|you|we|they) (is|was|has|does|doesn\'t)\b',
+    r'\bi (are|is)\b',
+    r'\b(\w+) \1\b',
+    r'\ba [aeiou]\w',
+    r'\ban [bcdfgjklmnpqrstvwxyz]\w',
+    r'\b(could|should|would|must|might) of\b',
+    r'\s[,.;:!?]',
+    r'(?-i:\bi\b)'
+]]
+
+def words(sentence: str) -> List[str]:
+    # Lowercased words (numbers collapsed into one token, so they don't count as unseen)
+    return ['<num>' if word[0].isdigit() else word for word in re.findall(r"[a-z0-9]+(?:'[a-z]+)?", sentence.lower())]
+
+def bigrams(sentence: str) -> List[str]:
+    # Word pairs, including the start and end of the sentence
+    tokens = ['<s>'] + words(sentence) + ['</s>']
+    return [f'{tokens[i]} {tokens[i+1]}' for i in range(0, len(tokens) - 1)]
+
+def sentence_hash(sentence: str) -> str:
+    return hashlib.sha256(' '.join(sentence.split()).encode()).hexdigest()
+
+class PreScreen:
+    '''
+    Local filter that decides which sentences are obviously correct, so they can skip the model.\n
+    A sentence passes if it has no words, or if it was confirmed correct before (stored as a hash).\n
+    If use_score, it also passes if no common error pattern matches it and enough of its word pairs were seen in confirmed-correct sentences
+    (a bigram model learned from every sentence the model has confirmed). This is off by default: a sentence made of seen pairs can still be wrong.\n
+    Confirmed sentences expire after ttl seconds, and only the max_entries most recently confirmed are kept.\n
+    The database is only opened on first use.
+    '''
+
+    def __init__(self, path=PRESCREEN_PATH, use_score=False, threshold=THRESHOLD, min_words=MIN_WORDS, max_entries=MAX_ENTRIES, ttl=TTL):
+        self.path = path
+        self.use_score = use_score
+        self.threshold = threshold
+        self.min_words = min_words
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.screened = 0
+        self.trivial_hits = 0
+        self.verified_hits = 0
+        self.scored_hits = 0
+        self.confirmed = 0
+        self.evictions = 0
+        # Number of confirmed sentences (counted once on connect, then kept up to date)
+        self.size = 0
+        self._conn = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn == None:
+            self._conn = sqlite3.connect(self.path)
+            self._conn.execute('PRAGMA journal_mode = WAL')
+            self._conn.execute('PRAGMA synchronous = NORMAL')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS verified (hash TEXT PRIMARY KEY, confirmed REAL NOT NULL)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS verified_confirmed ON verified (confirmed)')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS bigrams (bigram TEXT PRIMARY KEY, count INTEGER NOT NULL)')
+            self._conn.commit()
+            self.size = self._conn.execute('SELECT COUNT(*) FROM verified').fetchone()[0]
+        return self._conn
+
+    def score(self, sentence: str) -> float:
+        '''
+        Returns the fraction (0-1) of sentence's word pairs seen in confirmed-correct sentences.
+        '''
+        pairs = bigrams(sentence)
+        placeholders = ', '.join('?' * len(pairs))
+        seen = {row[0] for row in self._connect().execute(f'SELECT bigram FROM bigrams WHERE bigram IN ({placeholders})', pairs)}
+        return sum(1 for pair in pairs if pair in seen) / len(pairs)
+
+    def screen(self, sentence: str) -> bool:
+        '''
+        Decides whether sentence is correct without asking the model.\n
+        Takes in sentence; returns True if it's confidently correct, False if the model should check it.
+        '''
+        self.screened += 1
+        # If there are no words, there's nothing to check
+        if not re.search(r'[a-z]', sentence, re.IGNORECASE):
+            self.trivial_hits += 1
+            return True
+        conn = self._connect()
+        # If it was confirmed correct before (and that hasn't expired):
+        row = conn.execute('SELECT confirmed FROM verified WHERE hash = ?', (sentence_hash(sentence),)).fetchone()
+        if row != None and time.time() - row[0] <= self.ttl:
+            self.verified_hits += 1
+            return True
+        if row != None:
+            conn.execute('DELETE FROM verified WHERE hash = ?', (sentence_hash(sentence),))
+            conn.commit()
+            self.size -= 1
+        # If scoring is off, only exact matches skip the model
+        if not self.use_score:
+            return False
+        # If it looks like it has a common error, or it's too short to judge:
+        if any(pattern.search(sentence) for pattern in ERROR_PATTERNS) or len(words(sentence)) < self.min_words:
+            return False
+        # If it's made of word pairs seen in correct sentences:
+        if self.score(sentence) >= self.threshold:
+            self.scored_hits += 1
+            return True
+        return False
+
+    def confirm(self, sentences: List[str]) -> None:
+        '''
+        Remembers sentences the model confirmed correct (and learns their word pairs), forgetting the oldest ones past max_entries.\n
+        Takes in sentences[]; returns nothing.
+        '''
+        conn = self._connect()
+        now = time.time()
+        for sentence in sentences:
+            # Only learn from each sentence once (confirming it again just restarts its TTL)
+            if conn.execute('INSERT OR IGNORE INTO verified (hash, confirmed) VALUES (?, ?)', (sentence_hash(sentence), now)).rowcount == 0:
+                conn.execute('UPDATE verified SET confirmed = ? WHERE hash = ?', (now, sentence_hash(sentence)))
+                continue
+            self.size += 1
+            self.confirmed += 1
+            for pair in bigrams(sentence):
+                conn.execute('INSERT INTO bigrams (bigram, count) VALUES (?, 1) ON CONFLICT (bigram) DO UPDATE SET count = count + 1', (pair,))
+        if self.size > self.max_entries:
+            evicted = conn.execute('DELETE FROM verified WHERE hash IN (SELECT hash FROM verified ORDER BY confirmed LIMIT ?)', (self.size - self.max_entries,)).rowcount
+            self.size -= evicted
+            self.evictions += evicted
+        conn.commit()
+
+    def clear(self) -> None:
+        '''
+        Forgets every confirmed sentence and word pair.
+        '''
+        conn = self._connect()
+        conn.execute('DELETE FROM verified')
+        conn.execute('DELETE FROM bigrams')
+        conn.commit()
+        self.size = 0
+
+    def stats(self) -> dict:
+        '''
+        Returns how many sentences were screened, how many skipped the model (no words / confirmed before / by score), the hit rate, and how many sentences are known correct (and how many were forgotten to stay under max_entries).
+        '''
+        self._connect()
+        hits = self.trivial_hits + self.verified_hits + self.scored_hits
+        return {
+            'screened': self.screened,
+            'trivial_hits': self.trivial_hits,
+            'verified_hits': self.verified_hits,
+            'scored_hits': self.scored_hits,
+            'hit_rate': hits / self.screened if self.screened else 0.0,
+            'confirmed': self.confirmed,
+            'evictions': self.evictions,
+            'known_correct': self.size
+        }
+
+    def close(self) -> None:
+        if self._conn != None:
+            self._conn.close()
+            self._conn = None
@@ -0,0 +1,122 @@
+import sqlite3
+import hashlib
+import json
+import time
+from typing import Optional
+
+# Default location of the cache (next to 'credentials.json')
+CACHE_PATH = 'response_cache.sqlite3'
+# Max number of responses kept before the least recently used ones are evicted
+MAX_ENTRIES = 5000
+# Seconds before a cached response expires (1 week)
+TTL = 7 * 24 * 60 * 60
+# Seconds before a hit refreshes a response's last-used time (so most hits don't write to the database)
+ACCESS_REFRESH = 60 * 60
+
+def make_key(model_name: str, init_prompt: str, prompt: str, temp, max_tok) -> str:
+    '''
+    Content-addresses a call to OpenAI.\n
+    Takes in model_name, init_prompt, prompt, temp, max_tok; returns the sha256 hex digest of all of them.
+    '''
+    return hashlib.sha256(json.dumps([model_name, init_prompt, prompt, temp, max_tok]).encode()).hexdigest()
+
+class ResponseCache:
+    '''
+    Disk-backed (SQLite) cache of OpenAI responses with LRU eviction and a TTL.\n
+    The database is only opened on first use. Last-used times are only refreshed once they're access_refresh seconds old, so LRU order is approximate to within that.
+    '''
+
+    def __init__(self, path=CACHE_PATH, max_entries=MAX_ENTRIES, ttl=TTL, access_refresh=ACCESS_REFRESH):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.access_refresh = access_refresh
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Number of cached responses (counted once on connect, then kept up to date)
+        self.size = 0
+        self._conn = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn == None:
+            self._conn = sqlite3.connect(self.path)
+            # Commits don't wait for a full sync (the cache can afford to lose its last few writes in a crash)
+            self._conn.execute('PRAGMA journal_mode = WAL')
+            self._conn.execute('PRAGMA synchronous = NORMAL')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+            self._conn.commit()
+            self.size = self._conn.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+        return self._conn
+
+    def get(self, key: str) -> Optional[str]:
+        '''
+        Looks up a response.\n
+        Takes in key; returns the cached response, or None if it is missing or expired.
+        '''
+        conn = self._connect()
+        now = time.time()
+        row = conn.execute('SELECT value, created, accessed FROM responses WHERE key = ?', (key,)).fetchone()
+        # If missing:
+        if row == None:
+            self.misses += 1
+            return None
+        # If expired, drop it
+        if now - row[1] > self.ttl:
+            conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+            conn.commit()
+            self.size -= 1
+            self.misses += 1
+            return None
+        # Only write if the last-used time is stale
+        if now - row[2] > self.access_refresh:
+            conn.execute('UPDATE responses SET accessed = ? WHERE key = ?', (now, key))
+            conn.commit()
+        self.hits += 1
+        return row[0]
+
+    def put(self, key: str, value: str) -> None:
+        '''
+        Stores a response, evicting the least recently used ones if the cache is full.\n
+        Takes in key, value; returns nothing.
+        '''
+        conn = self._connect()
+        now = time.time()
+        if conn.execute('INSERT OR IGNORE INTO responses (key, value, created, accessed) VALUES (?, ?, ?, ?)', (key, value, now, now)).rowcount == 1:
+            self.size += 1
+        else:
+            conn.execute('UPDATE responses SET value = ?, created = ?, accessed = ? WHERE key = ?', (value, now, now, key))
+        if self.size > self.max_entries:
+            evicted = conn.execute('DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY accessed LIMIT ?)', (self.size - self.max_entries,)).rowcount
+            self.size -= evicted
+            self.evictions += evicted
+        conn.commit()
+
+    def clear(self) -> None:
+        '''
+        Deletes every cached response.
+        '''
+        conn = self._connect()
+        conn.execute('DELETE FROM responses')
+        conn.commit()
+        self.size = 0
+
+    def stats(self) -> dict:
+        '''
+        Returns hit/miss/eviction counters, the hit rate, and the number of cached responses.
+        '''
+        self._connect()
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'size': self.size
+        }
+
+    def close(self) -> None:
+        if self._conn != None:
+            self._conn.close()
+            self._conn = None
@@ -0,0 +1,65 @@
+import collections
+from typing import List, Optional
+import tracing
+
+# Latencies kept per (model, call type), for the percentiles the policy is tuned from
+LATENCY_WINDOW = 500
+
+class Router:
+    '''
+    Maps each call type to an ordered cascade of models (fastest first): a call goes to the first model, and only escalates to the next one if the response fails validation.\n
+    Records each routing decision (accepted / rejected / failed, per call type and model) and the measured latency of each model per call type.
+    '''
+
+    def __init__(self, routes: dict, latency_window=LATENCY_WINDOW):
+        self.routes = {call_type: list(models) for (call_type, models) in routes.items()}
+        self.latency_window = latency_window
+        # (model, call type): recent latencies
+        self.latencies = {}
+        # call type: {model: {'tried', 'accepted', 'rejected', 'failed'}}
+        self.decisions = {}
+
+    def cascade(self, call_type: str) -> List[str]:
+        '''
+        Returns the models to try for call_type, in order.\n
+        Raises KeyError if call_type has no route.
+        '''
+        return self.routes[call_type]
+
+    def record(self, call_type: str, model_name: str, decision: str) -> None:
+        # decision is 'accepted' (response used), 'rejected' (failed validation, escalated) or 'failed' (the call itself failed)
+        models = self.decisions.setdefault(call_type, {})
+        counts = models.setdefault(model_name, {'tried': 0, 'accepted': 0, 'rejected': 0, 'failed': 0})
+        counts['tried'] += 1
+        counts[decision] += 1
+
+    def observe(self, model_name: str, call_type: str, latency: float) -> None:
+        # Latency of one call that actually went to the model (not cached or shared)
+        key = (model_name, call_type)
+        if key not in self.latencies:
+            self.latencies[key] = collections.deque(maxlen=self.latency_window)
+        self.latencies[key].append(latency)
+
+    def latency(self, model_name: str, call_type: str, pct: float, min_samples=1) -> Optional[float]:
+        '''
+        Returns the pct percentile of model_name's recent latency on call_type, or None if there are fewer than min_samples measurements.
+        '''
+        latencies = self.latencies.get((model_name, call_type), ())
+        if len(latencies) < max(1, min_samples):
+            return None
+        return tracing.percentile(list(latencies), pct)
+
+    def stats(self) -> dict:
+        '''
+        Returns the routes, the routing decisions per call type (with each model's acceptance rate), and each model's p50/p95 latency per call type.
+        '''
+        decisions = {}
+        for (call_type, models) in self.decisions.items():
+            decisions[call_type] = {}
+            for (model_name, counts) in models.items():
+                decisions[call_type][model_name] = dict(counts)
+                decisions[call_type][model_name]['accept_rate'] = counts['accepted'] / counts['tried'] if counts['tried'] else 0.0
+        latencies = {}
+        for ((model_name, call_type), values) in self.latencies.items():
+            latencies.setdefault(call_type, {})[model_name] = {'count': len(values), 'p50': tracing.percentile(list(values), 50), 'p95': tracing.percentile(list(values), 95)}
+        return {'routes': self.routes, 'decisions': decisions, 'latency': latencies}
@@ -0,0 +1,246 @@
+import asyncio
+import heapq
+import itertools
+import random
+import time
+from typing import Callable, Awaitable, Any
+
+# Default (requests per minute, tokens per minute) budget for each model
+RATE_LIMITS = {
+    'gpt-3.5-turbo': (3500, 90000),
+    'gpt-4': (200, 40000)
+}
+# Budget for models not in RATE_LIMITS
+DEFAULT_RATE_LIMIT = (200, 40000)
+# Retries of transient errors (with jittered exponential backoff between BASE_DELAY and MAX_DELAY seconds)
+MAX_RETRIES = 5
+BASE_DELAY = 0.5
+MAX_DELAY = 20
+# Seconds after which a request stops being retried
+DEADLINE = 60
+
+# Lanes: user-initiated calls go first; background calls (prefetching, bulk checks, warm-ups) wait for them
+INTERACTIVE = 'interactive'
+BACKGROUND = 'background'
+LANE_PRIORITY = {INTERACTIVE: 0, BACKGROUND: 1}
+# Max background calls in flight (normally / while interactive calls are in flight)
+BACKGROUND_LIMIT = 4
+BUSY_BACKGROUND_LIMIT = 1
+
+class TokenBucket:
+    '''
+    Token bucket refilling at rate_per_minute, holding at most a minute's worth of tokens.
+    '''
+
+    def __init__(self, rate_per_minute: float):
+        self.rate = rate_per_minute / 60
+        self.capacity = rate_per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        '''
+        Returns how many seconds until amount tokens are available (0 if they already are).
+        '''
+        self._refill()
+        # Requests bigger than the whole bucket only wait for it to be full
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount: float) -> None:
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+    def drain(self) -> None:
+        # Empty the bucket (e.g. after the API says the limit was hit)
+        self._refill()
+        self.tokens = min(self.tokens, 0.0)
+
+class ModelBudget:
+    '''
+    Requests-per-minute and tokens-per-minute budgets of one model, handed out by lane priority, then first come, first served.
+    '''
+
+    def __init__(self, rpm: float, tpm: float):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        # Heap of (lane priority, arrival) tickets waiting for this budget
+        self.waiting = []
+
+class RequestScheduler:
+    '''
+    Queues calls until their model's rate limit budget allows them, and retries transient errors with jittered exponential backoff until a deadline.\n
+    Interactive calls are dispatched before background ones; background calls are held back while interactive calls are queued and throttled while they're in flight.
+    '''
+
+    def __init__(self, rate_limits=None, default_rate_limit=DEFAULT_RATE_LIMIT, max_retries=MAX_RETRIES, base_delay=BASE_DELAY, max_delay=MAX_DELAY, deadline=DEADLINE, background_limit=BACKGROUND_LIMIT, busy_background_limit=BUSY_BACKGROUND_LIMIT):
+        self.rate_limits = dict(RATE_LIMITS if rate_limits == None else rate_limits)
+        self.default_rate_limit = default_rate_limit
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.background_limit = background_limit
+        self.busy_background_limit = busy_background_limit
+        self.budgets = {}
+        self.changed = None
+        self.arrivals = itertools.count()
+        self.lanes = {lane: {'queued': 0, 'max_queued': 0, 'in_flight': 0, 'dispatched': 0, 'wait': 0.0, 'max_wait': 0.0} for lane in LANE_PRIORITY}
+        self.requests = 0
+        self.retries = 0
+        self.gave_up = 0
+        self.queue_wait = 0.0
+
+    def budget(self, model_name: str) -> ModelBudget:
+        if model_name not in self.budgets:
+            (rpm, tpm) = self.rate_limits.get(model_name, self.default_rate_limit)
+            self.budgets[model_name] = ModelBudget(rpm, tpm)
+        return self.budgets[model_name]
+
+    def lane_open(self, lane: str) -> bool:
+        '''
+        Returns whether a call in lane may be dispatched right now.
+        '''
+        if lane == INTERACTIVE:
+            return True
+        # Background calls wait for queued interactive calls, and are throttled while interactive ones are in flight
+        if self.lanes[INTERACTIVE]['queued'] > 0:
+            return False
+        limit = self.busy_background_limit if self.lanes[INTERACTIVE]['in_flight'] > 0 else self.background_limit
+        return self.lanes[lane]['in_flight'] < limit
+
+    async def acquire(self, model_name: str, tokens: int, lane=INTERACTIVE) -> float:
+        '''
+        Waits until it's this call's turn (by lane, then arrival) and the model's budget has room for one request of tokens tokens.\n
+        Takes in model_name, tokens, lane; returns the seconds spent waiting.
+        '''
+        if self.changed == None:
+            self.changed = asyncio.Condition()
+        start = time.monotonic()
+        budget = self.budget(model_name)
+        stats = self.lanes[lane]
+        ticket = (LANE_PRIORITY[lane], next(self.arrivals))
+        heapq.heappush(budget.waiting, ticket)
+        stats['queued'] += 1
+        stats['max_queued'] = max(stats['max_queued'], stats['queued'])
+        dispatched = False
+        try:
+            async with self.changed:
+                while True:
+                    if budget.waiting[0] == ticket and self.lane_open(lane):
+                        wait = max(budget.requests.wait_time(1), budget.tokens.wait_time(tokens))
+                        if wait == 0:
+                            break
+                        # Wait for the budget to refill (or for something to change, e.g. a more urgent call arriving)
+                        try:
+                            await asyncio.wait_for(self.changed.wait(), wait)
+                        except asyncio.TimeoutError:
+                            pass
+                    else:
+                        await self.changed.wait()
+                heapq.heappop(budget.waiting)
+                budget.requests.take(1)
+                budget.tokens.take(tokens)
+                stats['queued'] -= 1
+                stats['in_flight'] += 1
+                stats['dispatched'] += 1
+                dispatched = True
+                self.changed.notify_all()
+        finally:
+            # If cancelled while waiting, leave the queue
+            if not dispatched:
+                budget.waiting.remove(ticket)
+                heapq.heapify(budget.waiting)
+                stats['queued'] -= 1
+                self.notify()
+        waited = time.monotonic() - start
+        self.queue_wait += waited
+        stats['wait'] += waited
+        stats['max_wait'] = max(stats['max_wait'], waited)
+        return waited
+
+    def release(self, lane: str) -> None:
+        # A call in lane finished
+        self.lanes[lane]['in_flight'] -= 1
+        self.notify()
+
+    def notify(self) -> None:
+        # Wake up queued calls to re-check whether it's their turn
+        async def notify_all():
+            async with self.changed:
+                self.changed.notify_all()
+        if self.changed != None:
+            asyncio.ensure_future(notify_all())
+
+    def backoff(self, attempt: int, retry_after=None) -> float:
+        '''
+        Returns how long to wait before retry number attempt (full jitter, or the server's Retry-After if it asked for longer).
+        '''
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if retry_after != None:
+            delay = max(delay, retry_after)
+        return delay
+
+    async def run(self, model_name: str, tokens: int, send: Callable[[], Awaitable[Any]], is_retryable: Callable[[Exception], bool], is_rate_limit: Callable[[Exception], bool] = lambda e: False, lane=INTERACTIVE, on_dispatch: Callable[[float], None] = None) -> Any:
+        '''
+        Sends a request once it's its turn and the budget allows it, retrying transient errors until they succeed, retries run out, or the deadline passes.\n
+        Takes in model_name, tokens (estimated prompt + max tokens), send (makes the request), is_retryable(e), is_rate_limit(e), lane, on_dispatch(seconds queued) (called before each attempt); returns send()'s result.\n
+        Raises the last exception if the request can't be completed.
+        '''
+        self.requests += 1
+        deadline = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            waited = await self.acquire(model_name, tokens, lane)
+            try:
+                if on_dispatch != None:
+                    on_dispatch(waited)
+                return await send()
+            except Exception as e:
+                if not is_retryable(e) or attempt >= self.max_retries:
+                    self.gave_up += 1
+                    raise
+                # If the API says the limit was hit, stop everyone else from spending the budget too
+                if is_rate_limit(e):
+                    self.budget(model_name).requests.drain()
+                delay = self.backoff(attempt, retry_after(e))
+                if time.monotonic() + delay > deadline:
+                    self.gave_up += 1
+                    raise
+                self.retries += 1
+                attempt += 1
+            finally:
+                self.release(lane)
+            await asyncio.sleep(delay)
+
+    def stats(self) -> dict:
+        '''
+        Returns request/retry counters, total queue wait, queue depth and wait times per lane, and the budget left for each model.
+        '''
+        lanes = {}
+        for (lane, stats) in self.lanes.items():
+            lanes[lane] = dict(stats)
+            lanes[lane]['mean_wait'] = stats['wait'] / stats['dispatched'] if stats['dispatched'] else 0.0
+        return {
+            'requests': self.requests,
+            'retries': self.retries,
+            'gave_up': self.gave_up,
+            'queue_wait': self.queue_wait,
+            'lanes': lanes,
+            'budgets': {model_name: {'requests': budget.requests.tokens, 'tokens': budget.tokens.tokens} for (model_name, budget) in self.budgets.items()}
+        }
+
+def retry_after(e: Exception):
+    # Seconds the server asked to wait (Retry-After header), if any
+    headers = getattr(e, 'headers', None) or {}
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
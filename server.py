@@ -0,0 +1,287 @@
+'''
+Serves the check / explain / practice calls as a JSON HTTP API, so many users can share one process (one event loop, connection pool, response cache and scheduler):\n
+    $ python server.py --port 8080 --max-active 64 --max-queued 256\n
+    $ curl -H 'Authorization: Bearer sk-...' -d '{"text": "He are late. The sky is blue."}' http://127.0.0.1:8080/check\n
+Each request's calls use the API key in its Authorization header (or OPENAI_API_KEY if it has none).
+A key from a header is verified with one call the first time it's seen (and again after KEY_TTL), so cached results are never served to a made-up key.
+Every endpoint takes a JSON object and returns one with the result and err_instr ('' if nothing went wrong):\n
+    POST /check {"text"} -> {"errors": [{"sentence", "corrected", "start", "end"}], "err_instr"}\n
+    POST /explain {"sentence", "corrected"} -> {"explanation", "err_instr"}\n
+    POST /gen_correct, /gen_incorrect {"sentence"} -> {"sentence", "err_instr"}\n
+    POST /exercise {"sentence", "has_error"} -> {"exercise": {"sentence", "has_error", "correction", "concept", "explanation"}, "err_instr"}\n
+    GET /stats -> admission, scheduler, connection, single-flight, routing and hedging counters, and a summary of recent calls\n
+    GET /trace -> recent calls as Chrome trace-event JSON\n
+When max_active requests are running and max_queued more are waiting, new requests get 503 (with Retry-After) instead of piling up.
+'''
+
+import asyncio
+import argparse
+import hashlib
+import os
+import time
+from typing import Callable, Awaitable
+import openai
+from aiohttp import web
+import gpt_tester
+import hedging
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8080
+# Requests handled at the same time
+MAX_ACTIVE = 32
+# Requests waiting for a slot before new ones are turned away
+MAX_QUEUED = 128
+# Seconds a request may run (once admitted) before it's cancelled
+HANDLER_TIMEOUT = 120
+# Seconds in-flight requests get to finish on shutdown
+SHUTDOWN_TIMEOUT = 30
+# Seconds clients are asked to wait after a 503
+RETRY_AFTER = 1
+# Seconds a verified API key is trusted for before it's verified again
+KEY_TTL = 60 * 60
+# Verified API keys remembered (the oldest are forgotten first)
+MAX_KEYS = 10000
+# err_instr of a call made with a bad key (see gpt_tester.call_openai())
+BAD_KEY_ERR_MSG = 'API key invalid or expired. Please enter a valid API key.'
+
+class Admission:
+    '''
+    Lets at most max_active requests run at once, with up to max_queued more waiting for a slot; anything beyond that is turned away.
+    '''
+
+    def __init__(self, max_active=MAX_ACTIVE, max_queued=MAX_QUEUED):
+        self.max_active = max_active
+        self.max_queued = max_queued
+        self.slots = None
+        self.active = 0
+        self.queued = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.stopping = False
+
+    async def acquire(self) -> bool:
+        '''
+        Waits for a slot.\n
+        Returns True once the request may run, or False (straight away) if the queue is full or the server is shutting down.
+        '''
+        if self.slots == None:
+            self.slots = asyncio.Semaphore(self.max_active)
+        if self.stopping or (self.slots.locked() and self.queued >= self.max_queued):
+            self.rejected += 1
+            return False
+        self.queued += 1
+        try:
+            await self.slots.acquire()
+        finally:
+            self.queued -= 1
+        self.active += 1
+        self.admitted += 1
+        return True
+
+    def release(self) -> None:
+        self.active -= 1
+        self.slots.release()
+
+    def stats(self) -> dict:
+        return {
+            'active': self.active,
+            'queued': self.queued,
+            'admitted': self.admitted,
+            'rejected': self.rejected,
+            'timed_out': self.timed_out,
+            'stopping': self.stopping
+        }
+
+class KeyCheck:
+    '''
+    Remembers which API keys (by hash) were verified in the last ttl seconds, so each new key costs one call before anything (e.g. a cached result) is served with it.
+    '''
+
+    def __init__(self, ttl=KEY_TTL, max_keys=MAX_KEYS):
+        self.ttl = ttl
+        self.max_keys = max_keys
+        # sha256 of key: when it was verified
+        self.verified = {}
+        self.hits = 0
+        self.checked = 0
+        self.rejected = 0
+
+    async def verify(self, key: str) -> str:
+        '''
+        Verifies key (with the current task's request_api_key already set to it), unless it was verified recently.\n
+        Takes in key; returns err_instr ('' if the key is good).
+        '''
+        key_hash = hashlib.sha256(key.encode()).hexdigest()
+        verified = self.verified.get(key_hash)
+        if verified != None and time.time() - verified <= self.ttl:
+            self.hits += 1
+            return ''
+        self.checked += 1
+        # Never cached (identical checks in flight with the same key are still shared)
+        (out_msg, err_instr) = await gpt_tester.call_routed('verify_key', '', 'Hi', max_tok=1, use_cache=False)
+        if err_instr != '':
+            self.rejected += 1
+            return err_instr
+        self.verified.pop(key_hash, None)
+        self.verified[key_hash] = time.time()
+        if len(self.verified) > self.max_keys:
+            del self.verified[next(iter(self.verified))]
+        return ''
+
+    def stats(self) -> dict:
+        return {'known': len(self.verified), 'hits': self.hits, 'checked': self.checked, 'rejected': self.rejected}
+
+class BadRequest(Exception):
+    # The request body is missing a field (or has the wrong type)
+    pass
+
+def field(body: dict, name: str, kind=str):
+    # body[name], checked to be a kind
+    value = body.get(name)
+    if not isinstance(value, kind):
+        raise BadRequest(f'"{name}" is required and must be a {kind.__name__}.')
+    return value
+
+async def check(body: dict) -> dict:
+    (results, err_instr) = await gpt_tester.recheck(field(body, 'text'), [])
+    errors = [{'sentence': result.sentence, 'corrected': result.corrected, 'start': result.start, 'end': result.end} for result in results if result != None and result.has_error]
+    return {'errors': errors, 'err_instr': err_instr}
+
+async def explain(body: dict) -> dict:
+    (explanation, err_instr) = await gpt_tester.explain_error(field(body, 'sentence'), field(body, 'corrected'))
+    return {'explanation': explanation, 'err_instr': err_instr}
+
+async def gen_correct(body: dict) -> dict:
+    (sentence, err_instr) = await gpt_tester.gen_correct(field(body, 'sentence'))
+    return {'sentence': sentence, 'err_instr': err_instr}
+
+async def gen_incorrect(body: dict) -> dict:
+    (sentence, err_instr) = await gpt_tester.gen_incorrect(field(body, 'sentence'))
+    return {'sentence': sentence, 'err_instr': err_instr}
+
+async def exercise(body: dict) -> dict:
+    (bundle, err_instr) = await gpt_tester.gen_exercise_bundle(field(body, 'sentence'), field(body, 'has_error', bool))
+    return {'exercise': bundle._asdict() if bundle != None else None, 'err_instr': err_instr}
+
+# Endpoints (path: handler taking the request body)
+ENDPOINTS = {
+    '/check': check,
+    '/explain': explain,
+    '/gen_correct': gen_correct,
+    '/gen_incorrect': gen_incorrect,
+    '/exercise': exercise
+}
+
+def api_key(request: web.Request):
+    # Key from 'Authorization: Bearer <key>', or None
+    (scheme, _, key) = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() == 'bearer' and key.strip() != '':
+        return key.strip()
+    return None
+
+def make_handler(endpoint: Callable[[dict], Awaitable[dict]]):
+    '''
+    Wraps an endpoint with admission control, the per-request API key, body parsing and the request timeout.\n
+    Takes in endpoint; returns the aiohttp handler.
+    '''
+    async def handler(request: web.Request) -> web.Response:
+        app = request.app
+        admission = app['admission']
+        request_key = api_key(request)
+        key = request_key or openai.api_key
+        if key == None:
+            return web.json_response({'error': 'Missing API key (Authorization: Bearer <key>).'}, status=401)
+        try:
+            body = await request.json()
+        except ValueError:
+            return web.json_response({'error': 'Request body must be JSON.'}, status=400)
+        if not isinstance(body, dict):
+            return web.json_response({'error': 'Request body must be a JSON object.'}, status=400)
+
+        if not await admission.acquire():
+            return web.json_response({'error': 'Server busy. Please try again in a bit.'}, status=503, headers={'Retry-After': str(RETRY_AFTER)})
+        try:
+            # Every call this request makes uses its own key (set for this task and every task it creates) and the shared session
+            gpt_tester.request_api_key.set(key)
+            openai.aiosession.set(app['client'].session)
+            # Keys from the header have to be verified before anything is served with them (the server's own key is trusted)
+            if request_key != None and request_key != openai.api_key:
+                err_instr = await asyncio.wait_for(app['keys'].verify(request_key), app['timeout'])
+                if err_instr != '':
+                    return web.json_response({'error': err_instr}, status=401 if err_instr == BAD_KEY_ERR_MSG else 502)
+            result = await asyncio.wait_for(endpoint(body), app['timeout'])
+        except BadRequest as e:
+            return web.json_response({'error': str(e)}, status=400)
+        except asyncio.TimeoutError:
+            admission.timed_out += 1
+            return web.json_response({'error': 'Request timed out. Please try again in a bit.'}, status=504)
+        finally:
+            admission.release()
+        return web.json_response(result)
+    return handler
+
+async def stats(request: web.Request) -> web.Response:
+    return web.json_response({
+        'admission': request.app['admission'].stats(),
+        'keys': request.app['keys'].stats(),
+        'scheduler': gpt_tester.request_scheduler.stats() if gpt_tester.request_scheduler != None else None,
+        'connections': request.app['client'].stats(),
+        'single_flight': dict(gpt_tester.single_flight),
+        'routing': gpt_tester.router.stats() if gpt_tester.router != None else None,
+        'hedging': gpt_tester.hedger.stats() if gpt_tester.hedger != None else None,
+        'trace': gpt_tester.tracer.summary() if gpt_tester.tracer != None else None
+    })
+
+async def trace(request: web.Request) -> web.Response:
+    # Recent spans as Chrome trace-event JSON
+    if gpt_tester.tracer == None:
+        return web.json_response({'error': 'Tracing is off.'}, status=404)
+    return web.json_response(gpt_tester.tracer.chrome_trace())
+
+async def on_startup(app: web.Application) -> None:
+    await app['client'].start()
+
+async def on_shutdown(app: web.Application) -> None:
+    # Turn away new requests (in-flight ones get up to the shutdown timeout to finish)
+    app['admission'].stopping = True
+
+async def on_cleanup(app: web.Application) -> None:
+    await app['client'].close()
+
+def build_app(max_active=MAX_ACTIVE, max_queued=MAX_QUEUED, timeout=HANDLER_TIMEOUT, request_timeout=gpt_tester.REQUEST_TIMEOUT) -> web.Application:
+    app = web.Application()
+    app['admission'] = Admission(max_active, max_queued)
+    app['timeout'] = timeout
+    app['keys'] = KeyCheck()
+    app['client'] = gpt_tester.OpenAIClient(pool_size=max(gpt_tester.POOL_SIZE, max_active), request_timeout=request_timeout)
+    gpt_tester.client = app['client']
+    app.on_startup.append(on_startup)
+    app.on_shutdown.append(on_shutdown)
+    app.on_cleanup.append(on_cleanup)
+    for (path, endpoint) in ENDPOINTS.items():
+        app.router.add_post(path, make_handler(endpoint))
+    app.router.add_get('/stats', stats)
+    app.router.add_get('/trace', trace)
+    return app
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Serve the check / explain / practice calls as a JSON HTTP API.')
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--max-active', type=int, default=MAX_ACTIVE, help='requests handled at the same time')
+    parser.add_argument('--max-queued', type=int, default=MAX_QUEUED, help='requests waiting for a slot before new ones get 503')
+    parser.add_argument('--timeout', type=float, default=HANDLER_TIMEOUT, help='seconds a request may take')
+    parser.add_argument('--request-timeout', type=float, default=gpt_tester.REQUEST_TIMEOUT, help='seconds each call to OpenAI may take')
+    parser.add_argument('--hedge', action='store_true', help='send a duplicate of requests slower than usual (see hedging.py)')
+    parser.add_argument('--shutdown-timeout', type=float, default=SHUTDOWN_TIMEOUT, help='seconds in-flight requests get to finish on shutdown')
+    return parser.parse_args(argv)
+
+if __name__ == '__main__':
+    args = parse_args()
+    # Default key for requests without one (None: every request must bring its own)
+    openai.api_key = os.environ.get('OPENAI_API_KEY')
+    if args.hedge:
+        gpt_tester.hedger = hedging.Hedger(gpt_tester.HEDGED_CALL_TYPES)
+    app = build_app(args.max_active, args.max_queued, args.timeout, args.request_timeout)
+    web.run_app(app, host=args.host, port=args.port, shutdown_timeout=args.shutdown_timeout)
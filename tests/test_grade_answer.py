@@ -0,0 +1,23 @@
+from gpt_tester import Exercise, grade_answer
+
+EXERCISE = Exercise('The manager have reviewed the numbers for the second quarter.', True, 'The manager has reviewed the numbers for the second quarter.', 'subject-verb agreement', '')
+
+def test_same_words_as_correction():
+    assert grade_answer('The manager has reviewed the numbers for the second quarter.', EXERCISE) == True
+    assert grade_answer('the manager has reviewed the numbers for the second quarter', EXERCISE) == True
+
+def test_unchanged_answer():
+    assert grade_answer('The manager have reviewed the numbers for the second quarter.', EXERCISE) == False
+
+def test_near_misses_go_to_the_model():
+    # Each makes the fix but adds a new error
+    for answer in ['The manager has review the numbers for the second quarter.',
+                   'The manager has reviewed a numbers for the second quarter.',
+                   'The manager has reviewed the number for the second quarter.',
+                   'The manager has reviewed the numbers for second quarter.']:
+        assert grade_answer(answer, EXERCISE) == None
+
+def test_case_or_punctuation_fix():
+    exercise = Exercise('i went to the store.', True, 'I went to the store.', 'capitalization', '')
+    assert grade_answer('i went to the store.', exercise) == None
+    assert grade_answer('I went to the store.', exercise) == None
@@ -0,0 +1,22 @@
+from gpt_tester import parse_batch_response
+
+SENTENCES = ['He are late.', 'The sky is blue.']
+
+def test_well_formed():
+    results = parse_batch_response('```json\n[{"id": 1, "correct": false, "corrected": "He is late."}, {"id": 2, "correct": "yes", "corrected": "The sky is blue."}]\n```', SENTENCES)
+    assert [(result.has_error, result.corrected) for result in results] == [(True, 'He is late.'), (False, 'The sky is blue.')]
+
+def test_incorrect_without_correction_is_malformed():
+    assert parse_batch_response('[{"id": 1, "correct": false}]', SENTENCES[:1]) == None
+    assert parse_batch_response('[{"id": 1, "correct": false, "corrected": ""}]', SENTENCES[:1]) == None
+    assert parse_batch_response('[{"id": 1, "correct": false, "corrected": "He are late."}]', SENTENCES[:1]) == None
+
+def test_correct_with_a_different_sentence_is_malformed():
+    assert parse_batch_response('[{"id": 1, "correct": true, "corrected": "He is late."}]', SENTENCES[:1]) == None
+    # Only the words count (e.g. a dropped period is still the same sentence)
+    assert parse_batch_response('[{"id": 1, "correct": true, "corrected": "The sky is blue"}]', SENTENCES[1:])[0].has_error == False
+
+def test_verdict_must_be_boolean_or_yes_no():
+    assert parse_batch_response('[{"id": 1, "correct": "maybe", "corrected": "He is late."}]', SENTENCES[:1]) == None
+    assert parse_batch_response('[{"id": 1, "correct": 0, "corrected": "He is late."}]', SENTENCES[:1]) == None
+    assert parse_batch_response('[{"id": 1, "correct": "no", "corrected": "He is late."}]', SENTENCES[:1])[0].has_error == True
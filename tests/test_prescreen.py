@@ -0,0 +1,49 @@
+import prescreen
+
+CONFIRMED = 'The manager reviewed the numbers for the second quarter and sent them to the whole team on Monday morning before the meeting started.'
+NEAR_MISSES = ['The manager reviewed the numbers for the second quarter and sent them to whole team on Monday morning before the meeting started.',
+               'The manager reviewed the numbers for second quarter and sent them to the whole team on Monday morning before the meeting started.']
+
+def make_screener(**kwargs) -> prescreen.PreScreen:
+    screener = prescreen.PreScreen(path=':memory:', **kwargs)
+    screener.confirm([CONFIRMED])
+    return screener
+
+def test_confirmed_sentence_passes():
+    assert make_screener().screen(CONFIRMED) == True
+    assert make_screener(use_score=True).screen(CONFIRMED) == True
+
+def test_near_misses_go_to_the_model():
+    screener = make_screener()
+    for sentence in NEAR_MISSES:
+        assert screener.screen(sentence) == False
+
+def test_near_misses_go_to_the_model_when_scoring():
+    # Dropping a word leaves one unseen word pair
+    screener = make_screener(use_score=True)
+    for sentence in NEAR_MISSES:
+        assert screener.score(sentence) < 1
+        assert screener.screen(sentence) == False
+
+def test_scoring_passes_seen_word_pairs():
+    # Every word pair of this one is in a confirmed sentence
+    sentence = 'The manager reviewed the numbers.'
+    screener = make_screener(use_score=True)
+    screener.confirm(['The team reviewed the numbers.'])
+    assert screener.screen(sentence) == True
+    screener = make_screener()
+    screener.confirm(['The team reviewed the numbers.'])
+    assert screener.screen(sentence) == False
+
+def test_confirmed_sentences_expire():
+    screener = prescreen.PreScreen(path=':memory:', ttl=-1)
+    screener.confirm([CONFIRMED])
+    assert screener.screen(CONFIRMED) == False
+    assert screener.stats()['known_correct'] == 0
+
+def test_oldest_confirmed_sentences_are_forgotten():
+    screener = prescreen.PreScreen(path=':memory:', max_entries=2)
+    screener.confirm(['The sky is blue.'])
+    screener.confirm(['The grass is green.', 'The sun is bright.'])
+    assert screener.stats()['known_correct'] == 2
+    assert screener.evictions == 1
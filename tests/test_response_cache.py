@@ -0,0 +1,26 @@
+import response_cache
+
+def test_evicts_least_recently_used():
+    cache = response_cache.ResponseCache(path=':memory:', max_entries=2, access_refresh=0)
+    cache.put('a', '1')
+    cache.put('b', '2')
+    cache.put('a', '3')
+    assert cache.stats()['size'] == 2
+    cache.put('c', '4')
+    assert cache.get('b') == None
+    assert (cache.get('a'), cache.get('c')) == ('3', '4')
+    assert cache.stats()['size'] == 2
+    assert cache.evictions == 1
+
+def test_size_survives_reopening(tmp_path):
+    path = str(tmp_path / 'cache.sqlite3')
+    cache = response_cache.ResponseCache(path=path)
+    cache.put('a', '1')
+    cache.close()
+    assert response_cache.ResponseCache(path=path).stats()['size'] == 1
+
+def test_expired_responses_are_dropped():
+    cache = response_cache.ResponseCache(path=':memory:', ttl=-1)
+    cache.put('a', '1')
+    assert cache.get('a') == None
+    assert cache.stats()['size'] == 0
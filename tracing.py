@@ -0,0 +1,191 @@
+import asyncio
+import collections
+import contextvars
+import itertools
+import json
+import math
+import os
+import time
+from typing import List
+
+# Dollars per 1000 (prompt, completion) tokens of each model
+PRICES = {
+    'gpt-3.5-turbo': (0.0015, 0.002),
+    'gpt-4': (0.03, 0.06)
+}
+# Price of models not in PRICES
+DEFAULT_PRICE = (0.03, 0.06)
+# Finished spans kept for the rolling summary and trace export
+MAX_SPANS = 10000
+
+def estimate_cost(model_name: str, prompt_tokens: int, completion_tokens: int) -> float:
+    # Estimated dollars spent on one call
+    (prompt_price, completion_price) = PRICES.get(model_name, DEFAULT_PRICE)
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000
+
+def percentile(values: List[float], pct: float) -> float:
+    # Nearest-rank percentile (the smallest value with at least pct% of values at or below it); shared by routing.py and benchmark.py
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, math.ceil(pct * len(ordered) / 100) - 1))]
+
+def summarize(runs: List[dict], wall_time: float) -> dict:
+    '''
+    Summarizes the runs of one flow (benchmark.py) or batch (batch_check.py).\n
+    Takes in runs[] (one dict per document/call, with latency and usage counters), wall_time; returns the summary.
+    '''
+    latencies = [run['latency'] for run in runs]
+    n = len(runs) or 1
+    return {
+        'runs': len(runs),
+        'failed_runs': sum(1 for run in runs if run['err_instr'] != ''),
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+        'mean': sum(latencies) / n,
+        'calls_per_doc': sum(run['calls'] for run in runs) / n,
+        'cached_per_doc': sum(run['cached'] for run in runs) / n,
+        'deduped_per_doc': sum(run['deduped'] for run in runs) / n,
+        'screened_per_doc': sum(run['screened'] for run in runs) / n,
+        'tokens_per_doc': sum(run['prompt_tokens'] + run['completion_tokens'] for run in runs) / n,
+        'wall_time': wall_time,
+        'throughput': len(runs) / wall_time if wall_time > 0 else 0.0
+    }
+
+class Span:
+    '''
+    One timed piece of work: a user action (Check, Explain, Next, ...) or a call to the model inside one.\n
+    attrs holds whatever was recorded about it (model, call site, queue wait, tokens, cost, outcome, ...).
+    '''
+
+    def __init__(self, span_id: int, name: str, kind: str, parent=None, attrs=None):
+        self.span_id = span_id
+        self.name = name
+        self.kind = kind
+        self.parent = parent
+        # Top-level span this one is part of (its own id if it has no parent)
+        self.root_id = parent.root_id if parent != None else span_id
+        self.attrs = dict(attrs or {})
+        self.start = time.perf_counter()
+        self.end = None
+        # Resets current_span when the span finishes
+        self.token = None
+
+    @property
+    def duration(self) -> float:
+        return (self.end if self.end != None else time.perf_counter()) - self.start
+
+# Span the current task is in (and every task it creates), used as the parent of new spans
+current_span = contextvars.ContextVar('current_span', default=None)
+
+class Tracer:
+    '''
+    Records spans (nested through current_span), keeps the last max_spans finished ones, and summarizes or exports them.\n
+    Run an action with run(name, coro); time anything else with start() / finish().
+    '''
+
+    def __init__(self, max_spans=MAX_SPANS):
+        self.spans = collections.deque(maxlen=max_spans)
+        self.ids = itertools.count(1)
+        # perf_counter() at the start, so trace timestamps start near 0
+        self.origin = time.perf_counter()
+
+    def start(self, name: str, kind: str, **attrs) -> Span:
+        '''
+        Opens a span under the current one, and makes it the current one.\n
+        Takes in name, kind, attrs; returns the span (pass it to finish()).
+        '''
+        span = Span(next(self.ids), name, kind, parent=current_span.get(), attrs=attrs)
+        span.token = current_span.set(span)
+        return span
+
+    def finish(self, span: Span, **attrs) -> None:
+        # Closes span (recording attrs), and makes its parent the current span again
+        span.end = time.perf_counter()
+        span.attrs.update(attrs)
+        try:
+            current_span.reset(span.token)
+        except ValueError:
+            # Finished in a different context than it was started in
+            pass
+        self.spans.append(span)
+
+    async def run(self, name: str, coro, **attrs):
+        '''
+        Runs coro as a user action (every call it makes is nested under it).\n
+        Takes in name, coro, attrs; returns coro's result.
+        '''
+        span = self.start(name, 'action', **attrs)
+        outcome = 'ok'
+        try:
+            return await coro
+        except asyncio.CancelledError:
+            outcome = 'cancelled'
+            raise
+        except Exception as e:
+            outcome = f'error:{type(e).__name__}'
+            raise
+        finally:
+            self.finish(span, outcome=outcome)
+
+    def summary(self) -> dict:
+        '''
+        Summarizes the calls among the last max_spans spans, by call site and by model.\n
+        Returns {'calls', 'cost', 'by_call_site': {...}, 'by_model': {...}}, each group with count, failed, latency/queue wait percentiles, tokens and cost.
+        '''
+        calls = [span for span in self.spans if span.kind == 'call']
+        def group(spans: List[Span]) -> dict:
+            latencies = [span.duration for span in spans]
+            waits = [span.attrs.get('queue_wait', 0.0) for span in spans]
+            return {
+                'count': len(spans),
+                'failed': sum(1 for span in spans if span.attrs.get('outcome', '').startswith('error')),
+                'cached': sum(1 for span in spans if span.attrs.get('outcome') == 'cached'),
+                'p50': percentile(latencies, 50),
+                'p95': percentile(latencies, 95),
+                'mean_queue_wait': sum(waits) / len(spans) if spans else 0.0,
+                'p95_queue_wait': percentile(waits, 95),
+                'prompt_tokens': sum(span.attrs.get('prompt_tokens', 0) for span in spans),
+                'completion_tokens': sum(span.attrs.get('completion_tokens', 0) for span in spans),
+                'cost': sum(span.attrs.get('cost', 0.0) for span in spans)
+            }
+        by_call_site = collections.defaultdict(list)
+        by_model = collections.defaultdict(list)
+        for span in calls:
+            by_call_site[span.attrs.get('call_site', span.name)].append(span)
+            by_model[span.attrs.get('model', '')].append(span)
+        return {
+            'calls': len(calls),
+            'cost': sum(span.attrs.get('cost', 0.0) for span in calls),
+            'by_call_site': {name: group(spans) for (name, spans) in sorted(by_call_site.items())},
+            'by_model': {name: group(spans) for (name, spans) in sorted(by_model.items())}
+        }
+
+    def chrome_trace(self) -> dict:
+        '''
+        Returns the finished spans as Chrome trace events (open in chrome://tracing or https://ui.perfetto.dev).\n
+        Each user action gets its own track (async events with the action's id), with its calls nested under it (overlapping if they ran at the same time).
+        '''
+        events = []
+        for span in self.spans:
+            args = dict(span.attrs)
+            args['span_id'] = span.span_id
+            if span.parent != None:
+                args['parent_id'] = span.parent.span_id
+            args['kind'] = span.kind
+            event = {'name': span.name, 'cat': 'lexed', 'id': span.root_id, 'pid': os.getpid(), 'tid': 0}
+            events.append(dict(event, ph='b', ts=(span.start - self.origin) * 1e6, args=args))
+            events.append(dict(event, ph='e', ts=(span.end - self.origin) * 1e6))
+        events.sort(key=lambda event: event['ts'])
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def export(self, path: str) -> None:
+        # Saves chrome_trace() (plus summary()) as JSON to path
+        trace = self.chrome_trace()
+        trace['summary'] = self.summary()
+        with open(path, 'w') as file:
+            json.dump(trace, file)
+
+    def clear(self) -> None:
+        self.spans.clear()